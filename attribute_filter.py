@@ -8,18 +8,101 @@
 构造数据过程
 """
 
-from tools import *
+from tools import (
+    iter_json_data,get_json_data,cut_json_data,save_json,JsonWriter,Checkpoint,write_json_buckets,
+    chunked,ordered_pool_map,progress,
+    AhoCorasick,ParaIndex,load_vocab,regex_required_literals,get_first_pattern,
+    filter_chinese,filter_line,strQ2B,cached_strB2Q,collect_values,create_value_vocab,
+    json2BIO,json2mrc,containment_normalize,has_prefix,get_corpus_statistics,score_item,select_top_items,
+    NearDuplicateDetector,remove_near_duplicates
+)
 import re
 import os
-from tqdm import tqdm
+from collections import Counter
+from functools import lru_cache
+from itertools import islice
+from pipeline import Stage,Pipeline
 
 
+#编译模式的统计：compile为编译的正则数量，miss为首次编译某类模式的次数（直接使用已编译模式时不计数）
+pattern_cache_info=Counter()
+
+date_token_pattern=re.compile("[0-9一二三四五六七八九十零〇]+") #拆分出年月日
+date_century_pattern=re.compile("(公元前|公元)?(上个|[0-9一二三四五六七八九十零〇]+)世纪(?:([0-9一二三四五六七八九十零〇]+)(年代|年))?")
+date_decade_pattern=re.compile("(公元前|公元)?([0-9一二三四五六七八九十零〇]+)年代")
+date_month_names={"正月":"1月","元月":"1月","如月":"2月","腊月":"12月"}
+chinese_digits={c:i%10 for i,c in enumerate("0123456789〇一二三四五六七八九")}
+chinese_digits["零"]=0
+chinese_units={"十":10,"百":100,"千":1000}
+
+def chinese_to_int(s):
+    """
+    数字串转为整数，没有单位时逐位读，有单位时按位权读，不能转换时返回None
+    例：1980、一九八〇 ——> 1980    十二 ——> 12    二十三 ——> 23
+    """
+    if all(c in chinese_digits for c in s):
+        return int("".join(str(chinese_digits[c]) for c in s))
+    total,num=0,0
+    for c in s:
+        if c in chinese_digits:num=chinese_digits[c]
+        elif c in chinese_units:
+            total+=(num or 1)*chinese_units[c]
+            num=0
+        else:return None
+    return total+num
+
+def year_key(year,bc=False):
+    """年的（世纪,年代,年）三位，世纪按整百划分，如1980 ——> (20,8,0)，公元前的世纪为负数"""
+    century=year//100+1
+    return (-century if bc else century,year%100//10,year%10)
+
+def date_numbers_key(numbers,bc=False):
+    """拆分出的数字（年[,月[,日...]]）转为日期元组，没有数字时为空元组"""
+    if not numbers:return ()
+    return year_key(numbers[0],bc)+tuple(numbers[1:])
+
+@lru_cache(maxsize=1<<16)
+def parse_date(s):
+    """
+    把过滤出的日期解析成整数元组，同一个字符串只解析一次
+    元组为（世纪,年代,年,月,日）中的前几位，粒度越粗越短，粗粒度的日期是其包含的日期的前缀：
+        公元20世纪 ——> (20,)          20世纪80年代、80年代、1980年代 ——> (20,8)
+        1985年、一九八五 ——> (20,8,5)  1985年5月3日、1985-5-3、一九八五年五月三日 ——> (20,8,5,5,3)
+    公元前的世纪为负数，初、末等修饰词忽略，解析不了时返回None
+    """
+    if not s:return None
+    ret=date_century_pattern.search(s)
+    if ret:
+        bc,century,num,unit=ret.groups()
+        century=20 if century=="上个" else chinese_to_int(century)
+        if not century:return None
+        sign=-1 if bc=="公元前" else 1
+        if num is None:return (sign*century,)
+        num=chinese_to_int(num)
+        if num is None or num>=100:return None
+        key=(sign*century,num//10,num%10)
+        return key[:2] if unit=="年代" else key
+    ret=date_decade_pattern.search(s)
+    if ret:
+        bc,num=ret.groups()
+        num=chinese_to_int(num)
+        if num is None:return None
+        if num<100 and not bc:num+=1900 #上个世纪的年代
+        return year_key(num,bc=="公元前")[:2]
+    for name,month in date_month_names.items():s=s.replace(name,month)
+    numbers=[chinese_to_int(i) for i in date_token_pattern.findall(s)]
+    if not numbers or len(numbers)>3 or None in numbers:return None
+    return date_numbers_key(numbers,"公元前" in s)
+
 # 用面向对象方法解决
 class AttributeInterface():
     """
     属性工具的接口，包含所有特定属性用到的功能
     """
 
+    #编译好的模式，键为（属性类，模式种类），同一属性类的所有实例共用
+    compiled_patterns=dict()
+
     def __init__(self):
         self.statistics = {
             "识别出该属性数量":0,
@@ -29,6 +112,7 @@ class AttributeInterface():
             "多属性值数量":0,
             "文中直接抽出属性值数量":0
         }
+        self._vocab=None
 
     #必需重写的方法
     def get_name(self):
@@ -59,6 +143,35 @@ class AttributeInterface():
         """
         return None
 
+    def get_vocab(self):
+        """
+        返回该属性的词表（Vocab），没有词表的属性不用重写
+        """
+        return None
+
+    @property
+    def vocab(self):
+        """词表在第一次用到时才加载"""
+        if self._vocab is None:self._vocab=self.get_vocab()
+        return self._vocab
+
+    def get_compiled_patterns(self,kind):
+        """
+        返回编译好的模式列表，没有模式返回None
+        每个属性类的模式只编译一次，因此get_*_patterns返回的模式不能依赖实例
+        :param kind: "filter"、"extract"、"name"或"lenient_filter"，对应get_filter_patterns等方法
+        """
+        key=(type(self),kind)
+        if key in AttributeInterface.compiled_patterns:return AttributeInterface.compiled_patterns[key]
+        pattern_cache_info["miss"]+=1
+        patterns=getattr(self,"get_"+kind+"_patterns")()
+        if patterns:
+            patterns=[re.compile(pattern) for pattern in patterns]
+            pattern_cache_info["compile"]+=len(patterns)
+        else:patterns=None
+        AttributeInterface.compiled_patterns[key]=patterns
+        return patterns
+
     #自定义方法
     def get_name_in_infobox(self,attributes):
         """
@@ -66,14 +179,14 @@ class AttributeInterface():
         限定每个属性值对应infobox中的一个
         可自定义，默认为该方法
         """
-        patterns=self.get_name_patterns() 
+        patterns=self.get_compiled_patterns("name")
         if patterns is None:
             for attribute in attributes:
                 if self.get_name() in attribute:return attribute
         else:
             for pattern in patterns:
                 for attribute in attributes:
-                    if re.search(pattern,attribute):return attribute
+                    if pattern.search(attribute):return attribute
 
     def filter(self,s):
         """
@@ -85,7 +198,8 @@ class AttributeInterface():
         """
 
         if s: 
-            if self.get_filter_patterns():return get_first_pattern(self.get_filter_patterns(), s)
+            patterns=self.get_compiled_patterns("filter")
+            if patterns:return get_first_pattern(patterns, s)
             else:return s
 
     def extract(self,s):
@@ -101,18 +215,39 @@ class AttributeInterface():
         在识别之前要全角转半角以防出现模式下识别错误
         """
         if not s: return None
-        s = strB2Q(s)
-        if self.get_extract_patterns():
-            for pattern in self.get_extract_patterns():
-                ret = re.search(pattern, s)
+        s = cached_strB2Q(s)
+        patterns=self.get_compiled_patterns("extract")
+        if patterns:
+            for pattern in patterns:
+                ret = pattern.search(s)
                 if ret:
-                    ret = self.filter(ret.group())
+                    ret = self.filter_span(ret.group())
                     if ret: return ret
 
+    def filter_span(self,s):
+        """
+        对抽取模式匹配到的片段过滤，得到属性值
+        默认用filter，有词表的属性改为在片段中找词表中的词
+        """
+        return self.filter(s)
+
     def normalize(self,value_list):
         """对属性值列表做归一化，默认返回出现次数最多的"""
         return max(value_list,key=value_list.count)
 
+    def normalize_batch(self,value_lists):
+        """
+        对多个人的属性值列表归一化，结果与逐个调用normalize相同
+        相同的属性值列表只归一化一次
+        """
+        cache=dict()
+        res=[]
+        for value_list in value_lists:
+            key=tuple(value_list)
+            if key not in cache:cache[key]=self.normalize(value_list)
+            res.append(cache[key])
+        return res
+
     def equal(self,value1,value2):
         """判断两个属性值是否相等"""
       #  return value1==value2
@@ -121,6 +256,15 @@ class AttributeInterface():
         return False
 
 
+    def reset_statistics(self):
+        """统计数据清零"""
+        for key in self.statistics:self.statistics[key]=0
+
+    def merge_statistics(self,statistics):
+        """把其它进程（或其它实例）的统计数据累加进来"""
+        for key,value in statistics.items():
+            self.statistics[key]=self.statistics.get(key,0)+value
+
     def print_statistics(self):
         """
         打印统计数据
@@ -129,14 +273,17 @@ class AttributeInterface():
         print("统计结果：")
         print(self.statistics)
 
-    def remote_supervision(self,item):
+    def remote_supervision(self,item,para_index=None):
         """
         远程监督，详细介绍如下
         :param item:人物网页抽出来的4项
+        :param para_index: item["para"]的ParaIndex，多个属性处理同一个item时传入同一个，不传则按需建立
         :return:
             (属性值,属性值所在句子)，若句子为简介，则标识句子为"summary"，若没有，则返回None
             若属性值有多个，则返回元组列表
         """
+        name_prefix=self.get_name()+"："
+
         def search_value(self,value,item):
             """
             对属性值value进行搜索，范围为所有有效信息
@@ -144,17 +291,19 @@ class AttributeInterface():
             :param item: 4项
             :return: (属性值,属性值所在句子)，若句子为简介，则标识句子为"summary"，若没有，则返回None
             """
+            nonlocal para_index
             if item["summary"] and value in item["summary"]:
                 self.statistics["属性值在summary数量"]+=1
                 return (value, "summary")
             else:
                 if "para" in item.keys():
-                    for i in item["para"]:
+                    if para_index is None:para_index=ParaIndex(item["para"])
+                    for index in para_index.iter_containing(value):
+                        i=para_index.paras[index]
                         if value==i or len(i)<3:continue
-                        if value in i:
-                            if self.get_name()+"："!=i[:len(self.get_name()+"：")]:
-                                self.statistics["属性值在para数量"] += 1
-                                return (value, i)
+                        if not i.startswith(name_prefix):
+                            self.statistics["属性值在para数量"] += 1
+                            return (value, i)
 
         attribute_name=self.get_name_in_infobox(item["infobox"].keys())
         if attribute_name:
@@ -206,22 +355,7 @@ class Name(AttributeInterface):
         让子串相同的归为一类(如何实现)
         返回出现次数最多的
         """
-        res = dict()
-        for value in value_list:
-            flag=True
-            for res_value in res.keys():
-                if value in res_value:
-                    res[res_value] += 1
-                    flag=False
-                    break
-                elif res_value in value:
-                # 替换成更长的
-                    res[value] = res[res_value]
-                    del res[res_value]
-                    flag=False
-                    break
-            if flag:res[value]=1
-        return max(res.items(),key=lambda item:item[1])[0]
+        return containment_normalize(value_list)
               
     def filter(self,s):
         特殊案例=[
@@ -238,18 +372,18 @@ class Name(AttributeInterface):
         s=[i for i in s if i!="" and i!=" "]
         if s:return s[0]
 
-class BirthDate(AttributeInterface):
+class DateAttribute(AttributeInterface):
+    """
+    出生日期、逝世日期共用的过滤、归一化和比较
+    equal按拆分出的数字串（年,月,日）比较，前缀相同即相等，1985年与1985年5月相等，与80年代、20世纪不相等
+    lenient_equal为宽松比较，只在评价时按需使用：属性值解析成parse_date的（世纪,年代,年,月,日）元组，
+    粗粒度的日期与其包含的日期相等，如80年代与1985年、一九八五与1985
+    """
     def __init__(self):
         super().__init__()
-
-    def get_name(self):return "出生日期"
-
-    def get_extract_patterns(self) -> list:
-        return [
-            ".{4,12}(出生|生)",
-            "(出生|生于).{4,12}",
-            "（.{3,10}(-|—|~)"  # 后面至多匹配9个，至少匹配2个
-        ]
+        self.format_cache=dict()   #属性值——>过滤后拆分出的（年,月,日）
+        self.key_cache=dict()      #属性值——>比较用的拆分出的数字串
+        self.lenient_cache=dict()  #属性值——>宽松比较用的日期元组
 
     def get_filter_patterns(self) -> list:
         return [
@@ -262,12 +396,43 @@ class BirthDate(AttributeInterface):
             "[0-9一二三四五六七八九十〇零][十〇0零](年代)(初|前期|中期|后期|末期|末)*" #上个世纪的年代
         ]
 
-    def get_name_patterns(self)-> list:
+    def get_lenient_filter_patterns(self) -> list:
+        """宽松比较时用的过滤模式，年代、世纪年代在某年前面，公元后可带月日，不会把年代截成某年"""
         return [
-            "出生日期|出生年月|出生时间",
-            "生日"
+            "(公元前|公元)[0-9一二三四五六七八九十零〇]+(年代|世纪|年([0-9一二三四五六七八九十〇正如初元腊]+月([0-9一二三四五六七八九十〇]+(日|号))?)?)(初|前期|中期|后期|末期|末)*",              #前面带公元
+            r"[0-9一二三四五六七八九十零〇]+(年|\.)[0-9一二三四五六七八九十〇正如初元腊]+(月|\.)[0-9一二三四五六七八九十〇]+(日|号)",  # 某年某月某日
+            r"[0-9一二三四五六七八九十〇零]+(年|\.)[0-9一二三四五六七八九十〇]+(月)",  # 某年某月
+            "[0-9]{4}(-|—)[0-9]+((-|—)[0-9]+)*", #年-月-日
+            "[0-9一二三四五六七八九十〇零上个]+(世纪)[0-9一二三四五六七八九十〇零]*(年代|年)(初|前期|中期|后期|末期|末)*", #世纪年代
+            "[0-9一二三四五六七八九十〇零]*[0-9一二三四五六七八九十〇零][十〇0零](年代)(初|前期|中期|后期|末期|末)*", #年代
+            "[0-9一二三四五六七八九十〇零][0-9一二三四五六七八九十〇零][0-9一二三四五六七八九十〇零][0-9一二三四五六七八九十〇零]*(年)*",#某年
         ]
 
+    def format_date(self,value):
+        """过滤后拆分出（年,月,日），同一个值只算一次，过滤不出日期时返回None"""
+        if value not in self.format_cache:
+            if len(self.format_cache)>=1<<16:self.format_cache.clear()
+            value2=self.filter(value)
+            self.format_cache[value]=tuple(date_token_pattern.findall(value2)) if value2 is not None else None
+        return self.format_cache[value]
+
+    def date_key(self,value):
+        """比较用的拆分出的数字串，同一个值只拆一次"""
+        if value not in self.key_cache:
+            if len(self.key_cache)>=1<<16:self.key_cache.clear()
+            self.key_cache[value]=tuple(date_token_pattern.findall(value))
+        return self.key_cache[value]
+
+    def lenient_key(self,value):
+        """宽松比较用的日期元组，用宽松的模式过滤后解析，过滤不出时直接解析，仍解析不了时把拆分出的数字依次当作年、月、日"""
+        if value not in self.lenient_cache:
+            if len(self.lenient_cache)>=1<<16:self.lenient_cache.clear()
+            key=parse_date(get_first_pattern(self.get_compiled_patterns("lenient_filter"),value)) if value else None
+            if key is None:key=parse_date(value)
+            if key is None:key=date_numbers_key([chinese_to_int(i) for i in date_token_pattern.findall(value)])
+            self.lenient_cache[value]=key
+        return self.lenient_cache[value]
+
     def normalize(self,value_list):
         """
         先进行格式化（年，月，日）
@@ -275,38 +440,64 @@ class BirthDate(AttributeInterface):
         最后选出最多的那个
         """
 
-        res=dict() #代表年、月、日
-        value_list=[self.filter(value) for value in value_list]
-        value_list=[value for value in value_list if value is not None]
-        if not value_list:return None
-        for value in value_list:
-            format_value=tuple(re.findall("[0-9一二三四五六七八九十零〇]+",value)) #拆分出年月日
-            if format_value and len(format_value)<4:
-                flag=True
-                for res_value in res.keys():
-                    if res_value==format_value or res_value[:len(format_value)]==format_value:
-                        res[res_value]+=1
-                        flag=False
-                        break
-                    elif format_value[:len(res_value)]==res_value:
-                        res[format_value]=res[res_value]+1
-                        del res[res_value]
-                        flag=False
-                        break
-                if flag:res[format_value]=1
-        
-        res=max(res.items(),key=lambda item:item[1])[0]
+        format_values=[self.format_date(value) for value in value_list]
+        #按前缀关系聚类，如(1990,)与(1990,5)为一类，换成更长的时次数加一
+        res=containment_normalize([i for i in format_values if i and len(i)<4],has_prefix,replace_increment=1)
+        if res is None:return None
         if len(res)==1:return res[0]
         elif len(res)==2:return res[0]+"年"+res[1]+"月"
         else:return res[0]+"年"+res[1]+"月"+res[2]+"日"
 
     def equal(self,value1,value2):
-        value1=tuple(re.findall("[0-9一二三四五六七八九十零〇]+",value1)) #拆分出年月日
-        value2=tuple(re.findall("[0-9一二三四五六七八九十零〇]+",value2)) #拆分出年月日
+        value1=self.date_key(value1)
+        value2=self.date_key(value2)
         if value1[:len(value2)]==value2:return True
         if value2[:len(value1)]==value1:return True
         return False
 
+    def lenient_equal(self,value1,value2):
+        """宽松比较，粗粒度的日期与其包含的日期相等"""
+        value1=self.lenient_key(value1)
+        value2=self.lenient_key(value2)
+        if value1[:len(value2)]==value2:return True
+        if value2[:len(value1)]==value1:return True
+        return False
+
+class BirthDate(DateAttribute):
+    def get_name(self):return "出生日期"
+
+    def get_extract_patterns(self) -> list:
+        return [
+            ".{4,12}(出生|生)",
+            "(出生|生于).{4,12}",
+            "（.{3,10}(-|—|~)"  # 后面至多匹配9个，至少匹配2个
+        ]
+
+    def get_name_patterns(self)-> list:
+        return [
+            "出生日期|出生年月|出生时间",
+            "生日"
+        ]
+
+#建立词表时用到的result2.json中的属性
+vocab_source_attributes={"出生地":"出生地|籍贯","毕业院校":"毕业院校|毕业学校","民族":"民族"}
+vocab_source_values=dict()
+
+def get_vocab_source_values(name,json_file="result2.json"):
+    """
+    返回建立某个词表需要的属性值列表
+    第一次调用时遍历一次json_file，同时收集所有词表的属性值，取走后即释放，全部取走后连同json_file的条目一起释放
+    直接读了缓存的词表不会来取，剩下的值由prepare_vocabs释放
+    """
+    values=vocab_source_values.get(json_file)
+    if values is None or name not in values:
+        values=vocab_source_values[json_file]=collect_values(vocab_source_attributes,json_file)
+    result=values.pop(name)
+    if not values:del vocab_source_values[json_file]
+    return result
+
+china_pattern=re.compile("中共党员|中国共产党|入党|书记|党委")
+
 class Country(AttributeInterface):
 
     def __init__(self):
@@ -314,16 +505,19 @@ class Country(AttributeInterface):
         国家没有固定模式，但是有预定义词表
         """
         super().__init__()
+
+    def get_vocab(self):
         vocab_file = "output/country_vocab.json"
-        self.country_vocab = set(json.loads(open(vocab_file, encoding='utf-8').read()))  # 建立词表
+        return load_vocab("country", vocab_file, lambda: get_json_data(vocab_file))
 
-        self.extract_patterns = [
+    def get_name(self):return "国籍"
+
+    def get_extract_patterns(self) -> list:
+        return [
             "(国籍：|国籍为|出生在|生于|，).{2,10}",  # 后面至多匹配9个，至少匹配2个
             ".{2,10}国籍"  # 前面匹配数量
         ]
 
-    def get_name(self):return "国籍"
-
     def get_name_patterns(self)-> list:
         return [
             "国家|国籍"
@@ -334,9 +528,7 @@ class Country(AttributeInterface):
         若果出现多个国家，就返回列表，以尽可能多的标注为准
         """
         if filter_chinese(s) != s:  # 有分隔符或其它字符
-            result = []
-            for i in self.country_vocab:
-                if i in s: result.append(i)
+            result = self.vocab.matcher.find_all(s)
             if len(result) > 1: return result
             if len(result) == 1: return result[0]
         else:
@@ -349,43 +541,52 @@ class Country(AttributeInterface):
         :return:国籍，若没有国籍则返回None
         """
         if not s: return None
-        s = strB2Q(s)
-        for pattern in self.extract_patterns:
-            ret = re.search(pattern, s)
+        s = cached_strB2Q(s)
+        for pattern in self.get_compiled_patterns("extract"):
+            ret = pattern.search(s)
             if ret:
-                ret = ret.group()
-                for country in self.country_vocab:
-                    if country in ret: return country
+                country = self.filter_span(ret.group())
+                if country: return country
         # 在句子开头匹配
         for i in range(2, 9):
-            if s[:i] in self.country_vocab: return s[:i]
+            if s[:i] in self.vocab.word_set: return s[:i]
 
         # 肯定为中国国籍的标志
-        if re.search("中共党员|中国共产党|入党|书记|党委", s): return "中国"
+        if china_pattern.search(s): return "中国"
+
+    def filter_span(self, s):
+        return self.vocab.matcher.first(s)
       
 class BirthPlace(AttributeInterface):
     def __init__(self):
         super().__init__()
+
+    def get_vocab(self):
         vocab_file = "output/birthplace_vocab.json"
         if os.path.exists(vocab_file):
-            self.birthpalce_vocab = set(json.loads(open(vocab_file, encoding='utf-8').read()))  # 建立词表
+            return load_vocab("birthplace", vocab_file, lambda: get_json_data(vocab_file))
         else:
-            values = get_values("出生地|籍贯", "result2.json")
-            new_values = []
-            for value in values:
-                value =self.filter(value)
-                if value is not None and value !="":
-                    new_values.append(value)
-            self.birthpalce_vocab = set(create_value_vocab(new_values, vocab_file, limit_len=1))
-
-        self.extract_patterns=[
+            return load_vocab("birthplace", "result2.json", lambda: self.build_vocab(vocab_file))
+
+    def build_vocab(self, vocab_file):
+        """从result2.json的出生地、籍贯建立词表"""
+        values = get_vocab_source_values("出生地")
+        new_values = []
+        for value in values:
+            value =self.filter(value)
+            if value is not None and value !="":
+                new_values.append(value)
+        return create_value_vocab(new_values, vocab_file, limit_len=1)
+
+    def get_name(self):return "出生地"
+
+    def get_extract_patterns(self) -> list:
+        return [
             ".{0,15}(出生).{0,15}",
             "(生于).{2,10}",
             ".{2,10}人"
         ]
 
-    def get_name(self):return "出生地"
-
     def get_name_patterns(self)-> list:
         return [
             "出生地",
@@ -407,22 +608,9 @@ class BirthPlace(AttributeInterface):
             if s[-i:] in edge: s = s[:-i]
         return s
 
-    def extract(self, s):
-        """
-        :param s:
-        :param country_vocab:词表
-        :return:国籍，若没有国籍则返回None
-
-        可以抽多个
-        """
-        if not s: return None
-        s = strB2Q(s)
-        for pattern in self.extract_patterns:
-            ret = re.search(pattern, s)
-            if ret:
-                ret = ret.group()
-                for birthpalce in self.birthpalce_vocab:
-                    if birthpalce in ret: return birthpalce
+    def filter_span(self, s):
+        """抽取时在片段中找词表中的词"""
+        return self.vocab.matcher.first(s)
 
     def normalize(self,value_list):
         """
@@ -430,22 +618,18 @@ class BirthPlace(AttributeInterface):
         返回该类中出现次数最多的，最长包含串
         判断的时候要查看是否包含子串
         """
-        res = dict()
-        for value in value_list:
-            flag=True
-            for res_value in res.keys():
-                if value in res_value:
-                    res[res_value] += 1
-                    flag=False
-                    break
-                elif res_value in value:
-                # 替换成更长的
-                    res[value] = res[res_value]
-                    del res[res_value]
-                    flag=False
-                    break
-            if flag:res[value]=1
-        return max(res.items(),key=lambda item:item[1])[0]
+        return containment_normalize(value_list)
+
+single_school_patterns = [re.compile(pattern) for pattern in [
+    ".*(分校|学院|研究所)",  # 防止二级院校名丢失
+    ".*(学校|学院|学堂|学园|大学|院校|研究所|实验室)",
+    ".*(女中|初中|高中|附中|[0-9一二三四五六七八九十]+中|[0-9一二三四五六七八九十]+小)",
+    ".*(学|院|校)",  # 小学|中学|
+    ".*(大|专|师范|医科|班|堂|团|医药)"  # 研究院|书院|剧院|中科院|美术院|
+    # 卫校|分校|军校|艺校|党校
+    # 初中|高中|附中
+    # 医科大 北大
+]]
 
 class School(AttributeInterface):
 
@@ -454,27 +638,34 @@ class School(AttributeInterface):
     """
     def __init__(self):
         super().__init__()
+
+    def get_vocab(self):
         vocab_file = "output/school_vocab.json"
         if os.path.exists(vocab_file):
-            self.school_vocab = set(json.loads(open(vocab_file, encoding='utf-8').read()))  # 建立词表
+            return load_vocab("school", vocab_file, lambda: get_json_data(vocab_file))
         else:
-            values = get_values("毕业院校|毕业学校", "result2.json")
-            new_values = []
-            for value in values:
-                value =self.filter(value)
-                if value is not None and value !="":
-                    if isinstance(value,list):
-                        for i in value:new_values.append(i)
-                    else:new_values.append(value)
-            self.school_vocab = set(create_value_vocab(new_values, vocab_file, limit_len=1))
-
-        self.extract_patterns=[
+            return load_vocab("school", "result2.json", lambda: self.build_vocab(vocab_file))
+
+    def build_vocab(self, vocab_file):
+        """从result2.json的毕业院校建立词表"""
+        values = get_vocab_source_values("毕业院校")
+        new_values = []
+        for value in values:
+            value =self.filter(value)
+            if value is not None and value !="":
+                if isinstance(value,list):
+                    for i in value:new_values.append(i)
+                else:new_values.append(value)
+        return create_value_vocab(new_values, vocab_file, limit_len=1)
+
+    def get_name(self):return "毕业院校"
+
+    def get_extract_patterns(self) -> list:
+        return [
             ".{0,20}(毕业).{0,20}"
             ".{0,20}(学位|学历|专业).{0,20}"
         ]
 
-    def get_name(self):return "毕业院校"
-
     def get_name_patterns(self)-> list:
         return [
             "毕业院校|毕业学校"
@@ -501,19 +692,9 @@ class School(AttributeInterface):
             :return:
             """
             if s!=filter_chinese(s):return None
-            patterns = [
-                ".*(分校|学院|研究所)",  # 防止二级院校名丢失
-                ".*(学校|学院|学堂|学园|大学|院校|研究所|实验室)",
-                ".*(女中|初中|高中|附中|[0-9一二三四五六七八九十]+中|[0-9一二三四五六七八九十]+小)",
-                ".*(学|院|校)",  # 小学|中学|
-                ".*(大|专|师范|医科|班|堂|团|医药)"  # 研究院|书院|剧院|中科院|美术院|
-                # 卫校|分校|军校|艺校|党校
-                # 初中|高中|附中
-                # 医科大 北大
-            ]
             ret = None
-            for pattern in patterns:
-                ret = re.search(pattern, s)
+            for pattern in single_school_patterns:
+                ret = pattern.search(s)
                 if ret:
                     s = ret.group()
                     if s[:3] == "毕业于": s = s[3:]
@@ -533,22 +714,9 @@ class School(AttributeInterface):
         else:
             return single_school_filter(s)
 
-    def extract(self, s):
-        """
-        :param s:
-        :param country_vocab:词表
-        :return:国籍，若没有国籍则返回None
-
-        可以抽多个
-        """
-        if not s: return None
-        s = strB2Q(s)
-        for pattern in self.extract_patterns:
-            ret = re.search(pattern, s)
-            if ret:
-                ret = ret.group()
-                for school in self.school_vocab:
-                    if school in ret: return school
+    def filter_span(self, s):
+        """抽取时在片段中找词表中的词"""
+        return self.vocab.matcher.first(s)
 
     def normalize(self,value_list):
         """
@@ -568,25 +736,32 @@ class Nation(AttributeInterface):
     def __init__(self):
         super().__init__()
         """国籍也可以是民族"""
+
+    def get_vocab(self):
         vocab_file = "output/nation_vocab.json"
         if os.path.exists(vocab_file):
-            self.nation_vocab = set(json.loads(open(vocab_file, encoding='utf-8').read()))  # 建立词表
+            return load_vocab("nation", vocab_file, lambda: get_json_data(vocab_file))
         else:
-            values=get_values("民族","result2.json")
-            new_values=[]
-            for value in values:
-                if value is not None and value !="" and value!="族":
-                    if value[-1] in "族人":value=value[:-1]
-                new_values.append(value)
-            self.nation_vocab=set(create_value_vocab(new_values,vocab_file,limit_len=1))
+            return load_vocab("nation", "result2.json", lambda: self.build_vocab(vocab_file))
+
+    def build_vocab(self, vocab_file):
+        """从result2.json的民族建立词表"""
+        values=get_vocab_source_values("民族")
+        new_values=[]
+        for value in values:
+            if value is not None and value !="" and value!="族":
+                if value[-1] in "族人":value=value[:-1]
+            new_values.append(value)
+        return create_value_vocab(new_values,vocab_file,limit_len=1)
+
+    def get_name(self):return "民族" 
 
-        self.extract_patterns = [
+    def get_extract_patterns(self) -> list:
+        return [
             "(民族).{2,10}",  # 后面至多匹配9个，至少匹配2个
             ".{2,10}族"  # 前面匹配数量
         ]
 
-    def get_name(self):return "民族" 
-
     def filter(self, s):
         """
         将"族"去掉
@@ -614,16 +789,18 @@ class Nation(AttributeInterface):
         :return:国籍，若没有国籍则返回None
         """
         if not s: return None
-        s = strB2Q(s)
-        for pattern in self.extract_patterns:
-            ret = re.search(pattern, s)
+        s = cached_strB2Q(s)
+        for pattern in self.get_compiled_patterns("extract"):
+            ret = pattern.search(s)
             if ret:
-                ret = ret.group()
-                for nation in self.nation_vocab:
-                    if nation in ret: return nation
+                nation = self.filter_span(ret.group())
+                if nation: return nation
         # 在句子开头匹配
         for i in range(2, 9):
-            if s[:i] in self.nation_vocab: return s[:i]
+            if s[:i] in self.vocab.word_set: return s[:i]
+
+    def filter_span(self, s):
+        return self.vocab.matcher.first(s)
 
 class Gender(AttributeInterface):
 
@@ -698,27 +875,9 @@ class ForeignName(AttributeInterface):
         让子串相同的归为一类(如何实现)
         返回出现次数最多的
         """
-        res = dict()
-        for value in value_list:
-            flag=True
-            for res_value in res.keys():
-                if value in res_value:
-                    res[res_value] += 1
-                    flag=False
-                    break
-                elif res_value in value:
-                # 替换成更长的
-                    res[value] = res[res_value]
-                    del res[res_value]
-                    flag=False
-                    break
-            if flag:res[value]=1
-        return max(res.items(),key=lambda item:item[1])[0]
-
-class DeathDate(AttributeInterface):
-    def __init__(self):
-        super().__init__()
+        return containment_normalize(value_list)
 
+class DeathDate(DateAttribute):
     def get_name(self):return "逝世日期"
 
     def get_name_patterns(self)->list:
@@ -733,55 +892,6 @@ class DeathDate(AttributeInterface):
             "(-|—|~).{3,10}）"# 后面至多匹配9个，至少匹配2个
         ]
 
-    def get_filter_patterns(self) -> list:
-        return [
-            "(公元前|公元)[0-9一二三四五六七八九十零〇]+(年|年代|世纪)(初|前期|中期|后期|末期|末)*",              #前面带公元
-            "[0-9一二三四五六七八九十零〇]+(年|\.)[0-9一二三四五六七八九十〇正如初元腊]+(月|\.)[0-9一二三四五六七八九十〇]+(日|号)",  # 某年某月某日
-            "[0-9一二三四五六七八九十〇零]+(年|\.)[0-9一二三四五六七八九十〇]+(月)",  # 某年某月
-            "[0-9]{4}(-|—)[0-9]+((-|—)[0-9]+)*", #年-月-日
-            "[0-9一二三四五六七八九十〇零][0-9一二三四五六七八九十〇零][0-9一二三四五六七八九十〇零][0-9一二三四五六七八九十〇零]*(年)*",#某年
-            "[0-9一二三四五六七八九十〇零上个]+(世纪)[0-9一二三四五六七八九十〇零]*(年|年代)(初|前期|中期|后期|末期|末)*", #世纪年代
-            "[0-9一二三四五六七八九十〇零][十〇0零](年代)(初|前期|中期|后期|末期|末)*" #上个世纪的年代
-        ]
-
-    def normalize(self,value_list):
-        """
-        先进行格式化（年，月，日）
-        然后进行包含统计
-        最后选出最多的那个
-        """
-
-        res=dict() #代表年、月、日
-        value_list=[self.filter(value) for value in value_list]
-        value_list=[value for value in value_list if value is not None]
-        if not value_list:return None
-        for value in value_list:
-            format_value=tuple(re.findall("[0-9一二三四五六七八九十零〇]+",value)) #拆分出年月日
-            if format_value and len(format_value)<4:
-                flag=True
-                for res_value in res.keys():
-                    if res_value==format_value or res_value[:len(format_value)]==format_value:
-                        res[res_value]+=1
-                        flag=False
-                        break
-                    elif format_value[:len(res_value)]==res_value:
-                        res[format_value]=res[res_value]+1
-                        del res[res_value]
-                        flag=False
-                        break
-                if flag:res[format_value]=1
-        res=max(res.items(),key=lambda item:item[1])[0]
-        if len(res)==1:return res[0]
-        elif len(res)==2:return res[0]+"年"+res[1]+"月"
-        else:return res[0]+"年"+res[1]+"月"+res[2]+"日"
-
-    def equal(self,value1,value2):
-        value1=tuple(re.findall("[0-9一二三四五六七八九十零〇]+",value1)) #拆分出年月日
-        value2=tuple(re.findall("[0-9一二三四五六七八九十零〇]+",value2)) #拆分出年月日
-        if value1[:len(value2)]==value2:return True
-        if value2[:len(value1)]==value1:return True
-        return False
-
 class SportType(AttributeInterface):
     def __init__(self):
         super().__init__()
@@ -809,6 +919,8 @@ class SportType(AttributeInterface):
         if len(s)==1:return s[0]
         if s:return s
 
+production_pattern=re.compile("《.*?》")
+
 class Production(AttributeInterface):
     def __init__(self):
         super().__init__()
@@ -839,7 +951,7 @@ class Production(AttributeInterface):
 
         if not s :return None
         if "《" in s or "》" in s:
-            s=re.findall("《.*?》",s)
+            s=production_pattern.findall(s)
             if s==[]:return None
             s=[i[1:-1] for i in s]
             if len(s)==1:s=s[0]
@@ -994,6 +1106,8 @@ class Belief(AttributeInterface):
             return max(value_list,key=value_list.count)
         else : return []
 
+degree_name_pattern=re.compile("学历|学位")
+
 class Degree(AttributeInterface):
 
     def __init__(self):
@@ -1011,7 +1125,7 @@ class Degree(AttributeInterface):
 
     def get_name_in_infobox(self,attributes):
         for attribute in attributes:
-            if re.search("学历|学位",attribute):return attribute
+            if degree_name_pattern.search(attribute):return attribute
 
     def get_extract_patterns(self) -> list:
         return [
@@ -1099,161 +1213,323 @@ class Constellation(AttributeInterface):
         return ["白羊","金牛","双子","巨蟹","狮子","处女","天秤","天蝎","人马","摩羯","宝瓶","双鱼","山羊","牧羊","射手","射手","水瓶","蛇夫","天平"]
 
 
-def remote_supervision2(person_json,des_file,attribute_min_num=1):
+def remote_supervision2(person_json,des_file,attribute_min_num=1,pretty=False):
     """
     对item进行过滤
     """
-    file=open(person_json, 'r', encoding='utf-8')
-    data = json.loads(file.read())
-    file.close()
-    new_data=[]
-    for item in tqdm(data):
-        new_item=dict()
-        new_item["name"]=item["name"]
-        new_item["summary"]=[item["summary"]] if item["summary"] else []
-        new_item["infobox"]=dict()
-        for attribute,value in item["infobox"].items():
-            if item["summary"] and value in item["summary"]:new_item["infobox"][attribute]=value
-            elif item["para"]:
-                for para in item["para"]:
-                    if value in para:
-                        new_item["infobox"][attribute]=value
-                        new_item["summary"].append(para)
-                        break
-        if len(new_item["infobox"])>=attribute_min_num:new_data.append(new_item)
-    save_json(new_data,des_file)
+    data = iter_json_data(person_json)
+    with JsonWriter(des_file,pretty=pretty) as writer:
+        for item in progress(data):
+            new_item=dict()
+            new_item["name"]=item["name"]
+            new_item["summary"]=[item["summary"]] if item["summary"] else []
+            new_item["infobox"]=dict()
+            for attribute,value in item["infobox"].items():
+                if item["summary"] and value in item["summary"]:new_item["infobox"][attribute]=value
+                elif item["para"]:
+                    for para in item["para"]:
+                        if value in para:
+                            new_item["infobox"][attribute]=value
+                            new_item["summary"].append(para)
+                            break
+            if len(new_item["infobox"])>=attribute_min_num:writer.write(new_item)
+
+#属性注册表，按先前的属性、后加的属性的顺序排列
+attribute_classes=[
+    Country,Gender,Height,Weight,Nation,Degree,School,BirthPlace,BirthDate,DeathDate,
+    Name,ForeignName,SportType,SportTeam,Belief,SportPosition,PoliticsStatus,Constellation,Production
+]
+attribute_instances=dict()  #标准名称——>属性对象，进程内共享
+
+def _create_attributes():
+    """同一进程内每种属性只创建一次，创建属性对象不加载词表，词表在第一次用到时才加载"""
+    if not attribute_instances:
+        for attribute_class in attribute_classes:
+            attribute=attribute_class()
+            attribute_instances[attribute.get_name()]=attribute
+    return attribute_instances
+
+def get_attribute(name):
+    """按标准名称取属性对象"""
+    return _create_attributes()[name]
+
+def get_attributes(names=None):
+    """按names的顺序取属性对象，names为None时返回注册表中的全部属性"""
+    if names is None:return list(_create_attributes().values())
+    return [get_attribute(name) for name in names]
+
+#各处用到的属性
+remote_attribute_names=["国籍","性别","身高","体重","民族","学历","毕业院校","出生地","出生日期","逝世日期",
+    "姓名","外文名","运动项目","所属运动队","信仰","场上位置","政治面貌","星座","作品"]
+person_attribute_names=["国籍","性别","身高","体重","民族","学历","毕业院校","出生地","出生日期","逝世日期",
+    "姓名","外文名","运动项目","作品","所属运动队","场上位置","星座"]
+person_high_attribute_names=["国籍","性别","身高","体重","民族","学历","毕业院校","出生地","出生日期","逝世日期",
+    "姓名","外文名","运动项目","所属运动队","场上位置","信仰"]
+evaluate_attribute_names=["国籍","性别","身高","体重","民族","学历","毕业院校","出生地","出生日期","逝世日期",
+    "姓名","外文名","运动项目","所属运动队","信仰","场上位置"]
+
+class SentenceScanner():
+    """
+    多属性单遍扫描
+    一句话只做一次全角转换，再用所有属性抽取模式的必现字面量建成的一个AhoCorasick自动机扫描一遍，
+    只有字面量都出现了的模式才做正则匹配，最后用各属性的filter_span过滤
+    与extract不同，每个模式的所有不重叠匹配都作为候选，且不做句首词表匹配等兜底
+    用法：
+        scanner=SentenceScanner([BirthDate(),Height()])
+        scanner.scan("1990年5月3日出生，身高180cm")
+        ——> {"出生日期":[(0,9,"1990年5月3日"),(14,17,"180")],"身高":[(14,17,"180")]}
+    """
+
+    def __init__(self,attributes):
+        self.attributes=attributes
+        self.patterns=[] #（属性下标，编译后的模式，必现字面量组）
+        literals=[]
+        for index,attribute in enumerate(attributes):
+            for pattern in attribute.get_compiled_patterns("extract") or []:
+                groups=regex_required_literals(pattern)
+                self.patterns.append((index,pattern,groups))
+                for group in groups:literals+=sorted(group)
+        self.literal_matcher=AhoCorasick(literals)
+
+    def scan(self,s):
+        """
+        :param s: 句子
+        :return: {属性名称:[(起始位置,结束位置,属性值)]}，按模式先后、位置先后排列
+            位置为属性值在句中的位置，属性值被filter_span改写、不在匹配到的片段中时为整个片段的位置
+            全角转换不改变长度，位置同样适用于原句
+        """
+        result={attribute.get_name():[] for attribute in self.attributes}
+        if not s:return result
+        s=cached_strB2Q(s)
+        words=self.literal_matcher.words
+        found=set(words[i] for _,i in self.literal_matcher.iter_matches(s))
+        for index,pattern,groups in self.patterns:
+            if not all(found.intersection(group) for group in groups):continue
+            attribute=self.attributes[index]
+            for ret in pattern.finditer(s):
+                value=attribute.filter_span(ret.group())
+                if not value:continue
+                for value in (value if isinstance(value,list) else [value]):
+                    start=ret.group().find(value)
+                    if start<0:span=(ret.start(),ret.end())
+                    else:span=(ret.start()+start,ret.start()+start+len(value))
+                    result[attribute.get_name()].append(span+(value,))
+        return result
+
+def get_remote_attributes():
+    """远程监督用到的属性"""
+    return get_attributes(remote_attribute_names)
+
+def supervise_item(attributes,item):
+    """
+    对单个item做远程监督，只保留属性值所在的句子
+    :return: 新的item，没有有效属性或句子时返回None
+    """
+    introduction_para=dict()  #用dict保持句子出现的顺序，保证结果确定
+    new_infobox=dict()
+    para_index=ParaIndex(item["para"]) if "para" in item.keys() else None
+    for attribute in attributes:
+        value_content=attribute.remote_supervision(item,para_index)
+        if value_content:
+            if isinstance(value_content,list):
+                value=[]
+                for i in value_content:
+                    if i[1] != "summary":
+                        introduction_para[i[1]]=None
+                    value.append(i[0])
+                new_infobox[attribute.get_name()] = value
+            else:
+                if value_content[1]!="summary":
+                    introduction_para[value_content[1]]=None
+                new_infobox[attribute.get_name()]=value_content[0]
+    introduction_para=list(introduction_para)
+    new_summary = [item["summary"]]+introduction_para
+    new_summary=[filter_line(i) for i in new_summary if filter_line(i)is not None]
+
+    if new_infobox and new_summary:
 
-def remote_supervision_para(person_json,des_json,min_attribute_num=4):
+        for value in new_infobox.values():
+            if not value:print("value hehe")
+        for summ in new_summary:
+            if not new_summary:print("summary hehe")
+
+        return {"name":item["name"],"infobox":new_infobox,"summary":new_summary}
+
+def supervise_item_para(attributes,item,min_attribute_num):
+    """
+    对单个item做远程监督，保留para的全貌
+    :return: 新的item，属性数量不足min_attribute_num时返回None
+    """
+    new_infobox=dict()
+    para_index=ParaIndex(item["para"]) if "para" in item.keys() else None
+    for attribute in attributes:
+        value_content=attribute.remote_supervision(item,para_index)
+        if value_content:
+            if isinstance(value_content,list):
+                value=[]
+                for i in value_content:
+                    value.append(i[0])
+                new_infobox[attribute.get_name()] = value
+            else:
+                new_infobox[attribute.get_name()]=value_content[0]
+    if len(new_infobox)>=min_attribute_num:
+        new_item=dict(item) 
+        new_item["infobox"]=new_infobox
+        return new_item
+
+_worker_attributes=None
+
+def _init_supervision_worker():
+    """子进程初始化，每个进程只建一次属性对象和词表"""
+    global _worker_attributes
+    _worker_attributes=get_remote_attributes()
+
+def _supervise_chunk(task):
+    """子进程处理一块item，返回结果和这一块的统计数据"""
+    func,chunk,args=task
+    for attribute in _worker_attributes:attribute.reset_statistics()
+    result=[func(_worker_attributes,item,*args) for item in chunk]
+    return result,[attribute.statistics for attribute in _worker_attributes]
+
+def prepare_vocabs(attributes):
+    """
+    在父进程中加载各属性的词表，缓存文件不存在时在这里建好，子进程只读缓存，不会同时写同一个缓存文件
+    词表都加载后释放剩下的建表用的属性值
+    """
+    for attribute in attributes:attribute.vocab
+    vocab_source_values.clear()
+
+def supervise_chunks(attributes,data,func,args=(),processes=1,chunk_size=1000):
+    """
+    把data按chunk_size个item分块，对每个item调用func(attributes,item,*args)，按输入顺序逐块返回结果列表
+    返回一块时该块的统计数据已全部计入attributes，块之间的统计数据与已返回的结果一致
+    processes>1时交给进程池，子进程的统计数据按块合并回attributes
+    :param attributes: get_remote_attributes()的结果，子进程用同样顺序的属性
+    :param func: supervise_item 或 supervise_item_para
+    """
+    prepare_vocabs(attributes)
+    if processes<=1:
+        for chunk in chunked(data,chunk_size):yield [func(attributes,item,*args) for item in chunk]
+        return
+    tasks=((func,chunk,args) for chunk in chunked(data,chunk_size))
+    for result,statistics in ordered_pool_map(_supervise_chunk,tasks,processes,initializer=_init_supervision_worker):
+        for attribute,attribute_statistics in zip(attributes,statistics):
+            attribute.merge_statistics(attribute_statistics)
+        yield result
+
+def supervise_items(attributes,data,func,args=(),processes=1,chunk_size=1000):
+    """逐个返回supervise_chunks的结果"""
+    for result in supervise_chunks(attributes,data,func,args,processes,chunk_size):yield from result
+
+def supervise_to_file(attributes,person_json,des_json,func,args=(),pretty=False,processes=1,chunk_size=1000,
+                      checkpoint=None,checkpoint_every=None):
+    """
+    对person_json的每个item调用func，把非空结果按顺序写入des_json
+    checkpoint不为None时（只支持json lines），每处理checkpoint_every个item后，在下一个块结束时把进度、结果文件长度、
+    统计数据和person_json的大小、修改时间保存到checkpoint，已有断点则从断点继续，person_json变了则从头开始
+    断点文件由调用者在全部完成后删除
+    """
+    stat=os.stat(person_json)
+    source=[os.path.abspath(person_json),stat.st_size,stat.st_mtime_ns]
+    state=checkpoint.load() if checkpoint else None
+    if state and (state.get("source")!=source or not os.path.exists(des_json)):state=None
+    done,offset=0,None
+    if state:
+        done,offset=state["done"],state["offset"]
+        for attribute,attribute_statistics in zip(attributes,state["statistics"]):
+            attribute.merge_statistics(attribute_statistics)
+        print("从断点继续，已处理：",done)
+
+    data = islice(iter_json_data(person_json),done,None)
+    with JsonWriter(des_json,pretty=pretty,offset=offset) as writer:
+        for result in supervise_chunks(attributes,progress(data),func,args,processes,chunk_size):
+            for new_item in result:
+                if new_item:writer.write(new_item)
+            #只在块结束时保存，此时结果和统计数据都包含了整块
+            if checkpoint and (done+len(result))//checkpoint_every>done//checkpoint_every:
+                checkpoint.save({"source":source,"done":done+len(result),"offset":writer.tell(),
+                                 "statistics":[attribute.statistics for attribute in attributes]})
+            done+=len(result)
+
+def remote_supervision_para(person_json,des_json,min_attribute_num=4,pretty=False,processes=1,chunk_size=1000,checkpoint_every=None):
     """
     对item进行过滤,保留para的全貌
+    processes>1时多进程处理
+    checkpoint_every不为None时，过滤结果先按顺序写到des_json+".part"（json lines），断点保存到des_json+".ckpt"，
+    中断后用同样的参数再运行一次会从断点继续，全部过滤完再分桶写入des_json，然后删除这两个文件
     """
-    attributes=[
-        #先前的属性
-        Country(),Gender(),Height(),Weight(),Nation(),Degree(),School(),BirthPlace(),BirthDate(),DeathDate(),
-        #后加的属性
-        Name(),ForeignName(),SportType(),SportTeam(),Belief(),SportPosition(),PoliticsStatus(),Constellation(),Production()
-    ]
-
-    file=open(person_json, 'r', encoding='utf-8')
-    data = json.loads(file.read())
-    file.close()
-    new_data=[]
-    for item in tqdm(data):
-        new_infobox=dict()
-        for attribute in attributes:
-            value_content=attribute.remote_supervision(item)
-            if value_content:
-                if isinstance(value_content,list):
-                    value=[]
-                    for i in value_content:
-                        value.append(i[0])
-                    new_infobox[attribute.get_name()] = value
-                else:
-                    new_infobox[attribute.get_name()]=value_content[0]
-        if len(new_infobox)>=min_attribute_num:
-            new_item=dict(item) 
-            new_item["infobox"]=new_infobox
-            new_data.append(new_item)
-    new_data.sort(key=lambda item:len(item["infobox"]),reverse=True)
-    save_json(new_data,des_json)
-
-def remote_supervision(person_json,des_json):
+    attributes=get_remote_attributes()
+    for attribute in attributes:attribute.reset_statistics()  #属性对象是共享的，统计数据从零开始
+
+    key=lambda item:len(item["infobox"])
+    if not checkpoint_every:
+        data = iter_json_data(person_json)
+        new_data=supervise_items(attributes,progress(data),supervise_item_para,(min_attribute_num,),processes,chunk_size)
+        new_data=(item for item in new_data if item is not None)
+        #按属性数量分桶，等价于按属性数量从多到少排序
+        write_json_buckets(new_data,des_json,key=key,reverse=True,pretty=pretty)
+        return
+    part_json=des_json+".part"
+    checkpoint=Checkpoint(des_json+".ckpt")
+    supervise_to_file(attributes,person_json,part_json,supervise_item_para,(min_attribute_num,),False,processes,chunk_size,
+                      checkpoint,checkpoint_every)
+    #断点在分桶写完后才删除，分桶时中断，再运行会直接从.part重新分桶
+    write_json_buckets(iter_json_data(part_json),des_json,key=key,reverse=True,pretty=pretty)
+    checkpoint.remove()
+    os.remove(part_json)
+
+def remote_supervision(person_json,des_json,pretty=False,processes=1,chunk_size=1000,checkpoint_every=None):
     """
     对item进行过滤
+    processes>1时多进程处理，结果顺序和统计数据与单进程一致
+    checkpoint_every不为None时（只支持json lines），每处理这么多个item后，在下一个块结束时把进度、结果文件长度、
+    统计数据和person_json的大小、修改时间保存到des_json+".ckpt"
+    中断后用同样的参数再运行一次会从断点继续，person_json变了则从头开始，正常结束后删除断点文件
     """
-    attributes=[
-        #先前的属性
-        Country(),Gender(),Height(),Weight(),Nation(),Degree(),School(),BirthPlace(),BirthDate(),DeathDate(),
-        #后加的属性
-        Name(),ForeignName(),SportType(),SportTeam(),Belief(),SportPosition(),PoliticsStatus(),Constellation(),Production()
-    ]
-
-    file=open(person_json, 'r', encoding='utf-8')
-    data = json.loads(file.read())
-    file.close()
-    new_data=[]
-    for item in tqdm(data):
-        introduction_para=set()
-        new_infobox=dict()
-        for attribute in attributes:
-            value_content=attribute.remote_supervision(item)
-            if value_content:
-                if isinstance(value_content,list):
-                    value=[]
-                    for i in value_content:
-                        if i[1] != "summary":
-                            introduction_para.add(i[1])
-                        value.append(i[0])
-                    new_infobox[attribute.get_name()] = value
-                else:
-                    if value_content[1]!="summary":
-                        introduction_para.add(value_content[1])
-                    new_infobox[attribute.get_name()]=value_content[0]
-        introduction_para=list(introduction_para)
-        new_summary = [item["summary"]]+introduction_para
-        new_summary=[filter_line(i) for i in new_summary if filter_line(i)is not None]
-
-        if new_infobox and new_summary:
-
-            for value in new_infobox.values():
-                if not value:print("value hehe")
-            for summ in new_summary:
-                if not new_summary:print("summary hehe")
-
-            new_data.append({"name":item["name"],"infobox":new_infobox,"summary":new_summary})
+    #缩进列表格式不能从中间续写，开始处理前就报错，避免中断后留下无法使用的断点
+    if checkpoint_every and pretty:raise Exception("断点续写只支持json lines，不能与pretty=True同时使用")
+    attributes=get_remote_attributes()
+    for attribute in attributes:attribute.reset_statistics()  #属性对象是共享的，统计数据从零开始
+
+    checkpoint=Checkpoint(des_json+".ckpt") if checkpoint_every else None
+    supervise_to_file(attributes,person_json,des_json,supervise_item,(),pretty,processes,chunk_size,checkpoint,checkpoint_every)
+    if checkpoint:checkpoint.remove()
 
     for attribute in attributes:
         attribute.print_statistics()
-    save_json(new_data,des_json)
 
-def extract_person_attribute(source_file_list,des_json,attribute_min_num=2):
+def extract_person_attribute(source_file_list,des_json,attribute_min_num=2,pretty=False):
     """
     抽取出人物的实体
     source_file：所有实体文件
     attribute_min_num:最小属性数量
     return：列表
     """
-    res=[]
-    for source_file in source_file_list:
-        with open(source_file,'r',encoding="utf-8")as file:
-            data=json.loads(file.read())
-
-        attributes=[        #先前的属性
-            Country(),Gender(),Height(),Weight(),Nation(),Degree(),School(),BirthPlace(),BirthDate(),DeathDate(),
-            #后加的属性
-            Name(),ForeignName(),SportType(),Production(),SportTeam(),SportPosition(),Constellation()
-            ]
-        new_data=[]
-        print(len(data))
-        for item in data:
-            if not item:print("hehe")
-            attribute_num=0
-            for attribute in attributes:
-                if item["infobox"]and item["summary"]:
-                    if attribute.get_name_in_infobox(item["infobox"].keys()):attribute_num+=1
-            if attribute_num>=attribute_min_num:new_data.append(item)
-        res+=new_data
-    save_json(res,des_json)
+    with JsonWriter(des_json,pretty=pretty) as writer:
+        for source_file in source_file_list:
+            data=iter_json_data(source_file)
+
+            attributes=get_attributes(person_attribute_names)
+            for item in data:
+                if not item:print("hehe")
+                attribute_num=0
+                for attribute in attributes:
+                    if item["infobox"]and item["summary"]:
+                        if attribute.get_name_in_infobox(item["infobox"].keys()):attribute_num+=1
+                if attribute_num>=attribute_min_num:writer.write(item)
 
-def extract_person_high(source_file_list,des_json,attribute_min_num=5):
+def extract_person_high(source_file_list,des_json,attribute_min_num=5,pretty=False):
     """
     抽取出人物的实体
     source_file：所有实体文件
     attribute_min_num:最小属性数量
     return：列表
     """
-    res=[]
-    for source_file in source_file_list:
-        with open(source_file,'r',encoding="utf-8")as file:
-            data=json.loads(file.read())
-
-        attributes=[        #先前的属性
-            Country(),Gender(),Height(),Weight(),Nation(),Degree(),School(),BirthPlace(),BirthDate(),DeathDate(),
-            #后加的属性
-            Name(),ForeignName(),SportType(),SportTeam(),SportPosition(),Belief()
-            ]
-        new_data=[]
-        for item in tqdm(data):
+    def extract_items(source_file):
+        data=iter_json_data(source_file)
+
+        attributes=get_attributes(person_high_attribute_names)
+        for item in progress(data):
             new_item=dict(item)
             new_item["infobox"]=dict()
             attribute_num=0
@@ -1263,13 +1539,13 @@ def extract_person_high(source_file_list,des_json,attribute_min_num=5):
                     if attribute_name:
                         attribute_num+=1
                         new_item["infobox"][attribute.get_name()]=item["infobox"][attribute_name]
-            if attribute_num>=attribute_min_num:new_data.append(new_item)
-        res+=new_data
-    res.sort(key=lambda item:len(item["infobox"]),reverse=True)
+            if attribute_num>=attribute_min_num:yield new_item
 
-    save_json(res,des_json)
+    items=(item for source_file in source_file_list for item in extract_items(source_file))
+    #按属性数量分桶，等价于按属性数量从多到少排序
+    write_json_buckets(items,des_json,key=lambda item:len(item["infobox"]),reverse=True,pretty=pretty)
 
-def process_remote_data(remote_json,des_json):
+def process_remote_data(remote_json,des_json,pretty=False,top_k=None,start=0,dedupe_threshold=None,dedupe_report=None):
     """
     对特定属性再次处理
     单个字符属性值问题：民族、性别、血型  #已添加
@@ -1285,12 +1561,14 @@ def process_remote_data(remote_json,des_json):
 
     两种操作：
         修改item操作
-        item排序
+        item排序：top_k不为None时按score_item打分，只保留最好的第start到start+top_k个条目
+    去重：去掉同名条目，dedupe_threshold不为None时再用NearDuplicateDetector去掉summary近似重复的条目
+        dedupe_report不为None时把被合并的簇保存到该文件
     """
-    data=get_json_data(remote_json)
+    data=iter_json_data(remote_json)
     def summary_attribute(item):
         """让特定属性只在summary中出现"""
-        attributes = [Gender()]
+        attributes = get_attributes(["性别"])
         for attribute in attributes:
             if attribute.get_name() in item["infobox"].keys():
                 value=item["infobox"][attribute.get_name()]
@@ -1298,7 +1576,7 @@ def process_remote_data(remote_json,des_json):
 
     def implement_attribute(item):
         """格式补全"""
-        attributes=[Height(),Weight(),BirthDate(),DeathDate()]
+        attributes=get_attributes(["身高","体重","出生日期","逝世日期"])
         for attribute in attributes:
             if attribute.get_name() in item["infobox"]:
                 value=item["infobox"][attribute.get_name()]
@@ -1311,57 +1589,93 @@ def process_remote_data(remote_json,des_json):
                         break
 
     def remove_same_item(data):
-        new_data=[]
         person_set=set()
         for item in data:
             if item["name"] not in person_set:
                 person_set.add(item["name"])
-                new_data.append(item)
-        return new_data
-
-    def sort_data(data):
-        # 按照infobox的质量对其打分
-        """
-        按照infobox的质量对其打分
-        包括：
-            让更多的属性在上面
-            让更多稀有的属性在上面 属性占比倒数之和
-            让句长尽量分布均匀
-        :param data:
-        :return:
-        """
-        info = get_remote_json_info(remote_json)
-
-        #取中位数句长
-        mid_count = 0
-        mid_sentence_len=0
-        for k, v in info["句长分布"].items():
-            mid_count += v
-            if mid_count > info["条目数"] / 2:
-                mid_sentence_len = k
-                break
+                yield item
 
+    def implement_items(data):
         for item in data:
-            score=0
-            for attribute in item["infobox"].keys():
-                score+=info["条目数"]/info["属性分布"][attribute]
-                score+=len(item["infobox"])/sum([len(i) for i in item["summary"]])*10
-
-            item["score"]=score
-
-        data.sort(key=lambda item:item["score"],reverse=True)
-
+            if item["summary"] is None:continue
+            implement_attribute(item)
+            if len(item["infobox"])>2:yield item
 
-    data=[item for item in data if item["summary"] is not None]
-
-    for i in range(len(data)):
-        implement_attribute(data[i])
-    data=[item for item in data if len(item["infobox"])>2]
-    #sort_data(data)
+    data=implement_items(data)
     data=remove_same_item(data)
-    save_json(data,des_json)
-
-def evaluate_two_infobox(json_file,des_file):
+    if dedupe_threshold is not None:
+        detector=NearDuplicateDetector(threshold=dedupe_threshold)
+        data=remove_near_duplicates(data,detector)
+    if top_k:
+        #按infobox的质量打分，只保留最好的第start到start+top_k个条目
+        info=get_corpus_statistics(remote_json,value_attributes=()).result()
+        data=select_top_items(data,top_k,lambda item:score_item(item,info),start)
+    with JsonWriter(des_json,pretty=pretty) as writer:
+        writer.write_all(data)
+    if dedupe_threshold is not None:
+        print("近似重复条目数：",sum(len(i) for i in detector.clusters.values()))
+        if dedupe_report:save_json(detector.report(),dedupe_report)
+
+_evaluate_attributes=None
+_evaluate_lenient=False
+
+def _init_evaluate_worker(lenient=False):
+    """子进程初始化，每个进程只建一次属性对象"""
+    global _evaluate_attributes,_evaluate_lenient
+    _evaluate_attributes=get_attributes(evaluate_attribute_names)
+    _evaluate_lenient=lenient
+
+def _evaluate_chunk(chunk):
+    return evaluate_items(_evaluate_attributes,chunk,_evaluate_lenient)
+
+def evaluate_items(attributes,items,lenient=False):
+    """
+    评价一批item，每个属性的predict先用normalize_batch一起归一化
+    :param lenient: 是否另外用属性的lenient_equal（如日期按粒度宽松比较）计数，不影响right_count和不相等的对
+    :return:
+        计数列表，第i个为第i个属性的[gold_count,predict_count,right_count,exist_count,lenient_right_count]，
+        lenient为False或属性没有lenient_equal时lenient_right_count为0
+        不相等的（属性下标,gold,predict），按item、属性的顺序排列
+    """
+    counts=[]
+    mismatches=[]  #（item下标,属性下标,gold,predict）
+    for attribute_index,attribute in enumerate(attributes):
+        name=attribute.get_name()
+        gold_count=predict_count=right_count=exist_count=lenient_right_count=0
+        lenient_equal=getattr(attribute,"lenient_equal",None) if lenient else None
+        #转换数据格式，同一属性所有item的predict一起归一化
+        gold_values=[]
+        predict_indexes,predict_lists=[],[]
+        for item_index,item in enumerate(items):
+            gold_value=None
+            if name in item["gold"].keys():
+                gold_value=item["gold"][name]
+                if not isinstance(gold_value,list):gold_value=[gold_value]
+                gold_count+=len(gold_value)
+            gold_values.append(gold_value)
+            if name in item["predict"].keys():
+                predict_value=[i for i in item["predict"][name] if i]
+                if predict_value:
+                    predict_indexes.append(item_index)
+                    predict_lists.append(predict_value)
+        for item_index,predict_value in zip(predict_indexes,attribute.normalize_batch(predict_lists)):
+            if not predict_value:continue
+            if isinstance(predict_value,str):predict_value=[predict_value]
+            predict_count+=len(predict_value)
+            # 预测有单实际没有的不算
+            gold_value=gold_values[item_index]
+            if gold_value:
+                exist_count+=len(predict_value)
+                for i in gold_value:
+                    for j in predict_value:
+                        if attribute.equal(i,j):right_count+=1
+                        else:mismatches.append((item_index,attribute_index,i,j))
+                        if lenient_equal and lenient_equal(i,j):lenient_right_count+=1
+        counts.append([gold_count,predict_count,right_count,exist_count,lenient_right_count])
+    mismatches.sort(key=lambda mismatch:mismatch[:2])  #稳定排序，同一对内保持gold、predict的遍历顺序
+    return counts,[mismatch[1:] for mismatch in mismatches]
+
+def evaluate_two_infobox(json_file,des_file,processes=1,chunk_size=1000,max_samples=None,pretty=False,lenient=False):
     """
     从抽取的list中获取重要的信息
     出现次数最多的，出现最长的，第一次出现的，所有出现的集合
@@ -1371,57 +1685,35 @@ def evaluate_two_infobox(json_file,des_file):
 
     对于每一个属性：
         TP：
-    """    
-    attributes=[
-        #先前的属性
-        Country(),Gender(),Height(),Weight(),Nation(),Degree(),School(),BirthPlace(),BirthDate(),DeathDate(),
-        #后加的属性
-        Name(),ForeignName(),SportType(),SportTeam(),Belief(),SportPosition()
-    ]
 
-    result_data=[]
+    流式读取json_file，按chunk_size个item一批评价，processes>1时多进程处理，结果与单进程相同
+    计数按属性下标累加，不相等的属性值对边算边写入des_file（{"attribute","gold","predict"}）
+    :param max_samples: 每个属性最多写入的不相等的对数，None为全部
+    :param lenient: 为True时，有lenient_equal的属性（出生日期、逝世日期）另外报告宽松比较的lenient_right_count、lenient_P、
+        lenient_R、lenient_F，原来的right_count、P、R、F不变
+    """
+    attributes=get_attributes(evaluate_attribute_names)
+    counts=[[0]*5 for _ in attributes]
+    sample_counts=[0]*len(attributes)
+
+    chunks=chunked(iter_json_data(json_file),chunk_size)
+    if processes>1:results=ordered_pool_map(_evaluate_chunk,chunks,processes,initializer=_init_evaluate_worker,initargs=(lenient,))
+    else:results=(evaluate_items(attributes,chunk,lenient) for chunk in chunks)
+    with JsonWriter(des_file,pretty=pretty) as writer:
+        for chunk_counts,mismatches in results:
+            for row,chunk_row in zip(counts,chunk_counts):
+                for i,count in enumerate(chunk_row):row[i]+=count
+            for attribute_index,gold,predict in mismatches:
+                if max_samples is not None and sample_counts[attribute_index]>=max_samples:continue
+                sample_counts[attribute_index]+=1
+                writer.write({"attribute":attributes[attribute_index].get_name(),"gold":gold,"predict":predict})
 
     # gold_count,predict_count,right_count
-    attribute_count={
-        attribute.get_name():{"gold_count":0,"predict_count":0,"right_count":0,"exist_count":0} for attribute in attributes
-    }
-
-
-
-
+    attribute_count=dict()
+    for attribute,row in zip(attributes,counts):
+        attribute_count[attribute.get_name()]=dict(zip(["gold_count","predict_count","right_count","exist_count"],row))
+        if lenient and hasattr(attribute,"lenient_equal"):attribute_count[attribute.get_name()]["lenient_right_count"]=row[4]
 
-    data=get_json_data(json_file)
-    for item in data:
-        predict=item["predict"]
-        gold=item["gold"]
-        #转换数据格式：{name:{predict:[],gold:[]}}
-        for attribute in attributes:
-            gold_value=None
-            predict_value=None
-            if attribute.get_name() in gold.keys():
-                gold_value=gold[attribute.get_name()]
-                if not isinstance(gold_value,list):gold_value=[gold_value]
-                attribute_count[attribute.get_name()]["gold_count"]+=len(gold_value)
-
-            if attribute.get_name() in predict.keys():
-                predict_value=predict[attribute.get_name()]
-                predict_value=[i for i in predict_value if i]
-                if predict_value:predict_value=attribute.normalize(predict_value)
-                if predict_value:
-                    if isinstance(predict_value,str):predict_value=[predict_value]
-                    attribute_count[attribute.get_name()]["predict_count"]+=len(predict_value)
-
-            # 预测有单实际没有的不算
-            
-
-            if gold_value and predict_value:
-                attribute_count[attribute.get_name()]["exist_count"]+=len(predict_value)
-                for i in gold_value:
-                    for j in predict_value:
-                        if attribute.equal(i,j):
-                            attribute_count[attribute.get_name()]["right_count"]+=1
-                        else:result_data.append([i,j])
-    
     def format_num(num):
         return str(int(num*10000)/100)+"%"
     for i in attribute_count:
@@ -1439,22 +1731,35 @@ def evaluate_two_infobox(json_file,des_file):
             attribute_count[i]["R2"]=format_num(attribute_count[i]["R2"])
             attribute_count[i]["F"]=format_num(attribute_count[i]["F"])
             attribute_count[i]["F2"]=format_num(attribute_count[i]["F2"])
+        #宽松比较单独报告
+        lenient_right_count=attribute_count[i].get("lenient_right_count")
+        if lenient_right_count:
+            P=lenient_right_count/attribute_count[i]["gold_count"]
+            R=lenient_right_count/attribute_count[i]["predict_count"]
+            attribute_count[i]["lenient_P"]=format_num(P)
+            attribute_count[i]["lenient_R"]=format_num(R)
+            attribute_count[i]["lenient_F"]=format_num(2*P*R/(P+R))
         print(i,attribute_count[i])
 
-    save_json(result_data,des_file)
     return attribute_count
 
 # 以下为数据构造函数，其中数据源为person_data3.json，如果想要复现的话将里面的"output/extract_info/person_data3.json"和其他过程文件改成你自己的person_data3.json目录即可
 
-def make_remote_data_para():
+# 各阶段的输出按输入、参数和代码缓存，没变的阶段自动跳过，见pipeline.py
+
+def make_remote_data_para(processes=1,force=()):
     #造全部人物介绍数据
     total_person="output/extract_info/person_data3.json" 
     remote_supervision_result="output/attribute_19_result_para.json"
     remote_supervision_result_process="output/remote_supervision_result_process_para.json"
-   # remote_supervision_para(total_person,remote_supervision_result)
-    process_remote_data(remote_supervision_result,remote_supervision_result_process)
-
-def make_remote_data():
+    return Pipeline([
+        #远程监督最耗时，中断后从断点继续
+        Stage("remote_supervision_para",remote_supervision_para,[total_person],remote_supervision_result,
+              options={"processes":processes,"checkpoint_every":10000}),
+        Stage("process_remote_data_para",process_remote_data,[remote_supervision_result],remote_supervision_result_process),
+    ]).run(force=force)
+
+def make_remote_data(processes=1,force=()):
     #造只包含不是人物介绍的数据
     total_person="output/extract_info/person_data3.json"
     remote_supervision_result="output/attribute_17_result.json"
@@ -1462,11 +1767,16 @@ def make_remote_data():
     remote_supervision_result_process_cut="output/remote_supervision_result_process_cut.json"
     mrc_BIO_file="output/BIO_output/mrc"
     lstm_BIO_file="output/BIO_output/bio"
-    remote_supervision(total_person,remote_supervision_result)
-    process_remote_data(remote_supervision_result,remote_supervision_result_process)
-    cut_json_data(remote_supervision_result_process,remote_supervision_result_process_cut,1000,41000)
-    json2mrc(remote_supervision_result_process_cut,mrc_BIO_file)
-    json2BIO(remote_supervision_result_process_cut,lstm_BIO_file)
+    return Pipeline([
+        #远程监督最耗时，中断后从断点继续
+        Stage("remote_supervision",remote_supervision,[total_person],remote_supervision_result,
+              options={"processes":processes,"checkpoint_every":10000}),
+        Stage("process_remote_data",process_remote_data,[remote_supervision_result],remote_supervision_result_process),
+        Stage("cut_json_data",cut_json_data,[remote_supervision_result_process],remote_supervision_result_process_cut,
+              {"start_idx":1000,"end_idx":41000}),
+        Stage("json2mrc",json2mrc,[remote_supervision_result_process_cut],mrc_BIO_file,directory=True),
+        Stage("json2BIO",json2BIO,[remote_supervision_result_process_cut],lstm_BIO_file),
+    ]).run(force=force)
 
 
 
@@ -0,0 +1,200 @@
+# coding:utf-8
+
+"""
+命令行入口
+各子命令用到时才导入对应模块，导入时不读写任何文件
+用法：
+    python cli.py remote-supervise output/extract_info/person_data3.json output/attribute_17_result.json
+    python cli.py process output/attribute_17_result.json output/remote_supervision_result_process.json
+    python cli.py select output/remote_supervision_result_process.json output/remote_supervision_result_process_top.json 40000 --start 1000
+    python cli.py cut output/remote_supervision_result_process.json output/remote_supervision_result_process_cut.json 1000 41000
+    python cli.py split output/remote_supervision_result_process.json train.json test.json dev.json
+    python cli.py to-mrc output/remote_supervision_result_process_cut.json output/BIO_output/mrc
+    python cli.py to-bio output/remote_supervision_result_process_cut.json output/BIO_output/bio
+    python cli.py stats output/remote_supervision_result_process.json
+    python cli.py make
+    python cli.py evaluate output/model_output/dev_output_para_crf.json output/model_output/dev_output_para_crf_result.json
+"""
+
+import argparse
+import os
+
+
+def remote_supervise(args):
+    from attribute_filter import remote_supervision,remote_supervision_para
+    if args.para:
+        remote_supervision_para(args.person_json,args.des_json,args.min_attribute_num,
+                                pretty=args.pretty,processes=args.processes,chunk_size=args.chunk_size)
+    else:
+        remote_supervision(args.person_json,args.des_json,
+                           pretty=args.pretty,processes=args.processes,chunk_size=args.chunk_size)
+
+def process(args):
+    from attribute_filter import process_remote_data
+    process_remote_data(args.remote_json,args.des_json,pretty=args.pretty,top_k=args.top_k,start=args.start,
+                        dedupe_threshold=args.dedupe_threshold,dedupe_report=args.dedupe_report)
+
+def dedupe(args):
+    from tools import remove_near_duplicate_file
+    detector=remove_near_duplicate_file(args.json_file,args.des_file,args.report,pretty=args.pretty,
+                                        threshold=args.threshold,num_perm=args.num_perm,bands=args.bands,shingle_size=args.shingle_size)
+    print("近似重复条目数：",sum(len(i) for i in detector.clusters.values()))
+
+def select(args):
+    from tools import select_json_items
+    select_json_items(args.json_file,args.des_file,args.k,start=args.start,by=args.by,pretty=args.pretty)
+
+def cut(args):
+    from tools import cut_json_data
+    cut_json_data(args.data_file,args.des_file,args.start,args.end,pretty=args.pretty)
+
+def shuffle(args):
+    from tools import shuffle_json_data
+    shuffle_json_data(args.json_file,args.des_file,seed=args.seed,pretty=args.pretty,
+                      max_bucket_bytes=args.max_bucket_mb<<20)
+
+def split(args):
+    from tools import split_json_data,shard_json_data
+    if args.shards:counts=shard_json_data(args.json_file,args.des_files[0],args.shards,seed=args.seed,pretty=args.pretty)
+    else:counts=split_json_data(args.json_file,args.des_files,args.rate or "default",seed=args.seed,pretty=args.pretty)
+    print(counts)
+
+def to_mrc(args):
+    from tools import json2mrc,json2mrc_all
+    os.makedirs(args.des_mrc_dir,exist_ok=True)
+    if args.all:json2mrc_all(args.json_file,args.des_mrc_dir,sep=args.sep,compact=args.compact)
+    else:json2mrc(args.json_file,args.des_mrc_dir,mode=args.mode,sep=args.sep,stream=args.stream,seed=args.seed,shuffle=args.shuffle)
+
+def to_bio(args):
+    from tools import json2BIO
+    json2BIO(args.json_file,args.BIO_file,sep=args.sep,mode=args.mode)
+
+def stats(args):
+    from tools import get_remote_json_info
+    get_remote_json_info(args.json_file,approx=args.approx)
+
+def evaluate(args):
+    from attribute_filter import evaluate_two_infobox
+    evaluate_two_infobox(args.json_file,args.des_file,processes=args.processes,chunk_size=args.chunk_size,
+                         max_samples=args.max_samples,lenient=args.lenient)
+
+def make(args):
+    from attribute_filter import make_remote_data,make_remote_data_para
+    if args.para:make_remote_data_para(processes=args.processes,force=args.force)
+    else:make_remote_data(processes=args.processes,force=args.force)
+
+def get_parser():
+    parser=argparse.ArgumentParser(description="人物属性抽取数据构造")
+    subparsers=parser.add_subparsers(dest="command",required=True)
+
+    p=subparsers.add_parser("remote-supervise",help="远程监督，只保留属性值所在的句子")
+    p.add_argument("person_json")
+    p.add_argument("des_json")
+    p.add_argument("--para",action="store_true",help="保留para的全貌，结果按属性数量从多到少排列")
+    p.add_argument("--min-attribute-num",type=int,default=4,help="--para时的最小属性数量")
+    p.add_argument("--processes",type=int,default=1)
+    p.add_argument("--chunk-size",type=int,default=1000)
+    p.add_argument("--pretty",action="store_true",help="保存为带缩进的json列表，默认为json lines")
+    p.set_defaults(func=remote_supervise)
+
+    p=subparsers.add_parser("process",help="对远程监督结果中的特定属性再次处理")
+    p.add_argument("remote_json")
+    p.add_argument("des_json")
+    p.add_argument("--top-k",type=int,default=None,help="只保留打分最高的top-k个条目")
+    p.add_argument("--start",type=int,default=0,help="跳过打分最高的start个条目")
+    p.add_argument("--dedupe-threshold",type=float,default=None,help="summary近似重复的相似度阈值，不设置则只按姓名去重")
+    p.add_argument("--dedupe-report",default=None,help="保存被合并的簇")
+    p.add_argument("--pretty",action="store_true")
+    p.set_defaults(func=process)
+
+    p=subparsers.add_parser("dedupe",help="用MinHash去掉summary近似重复的条目")
+    p.add_argument("json_file")
+    p.add_argument("des_file")
+    p.add_argument("--report",default=None,help="保存被合并的簇")
+    p.add_argument("--threshold",type=float,default=0.8)
+    p.add_argument("--num-perm",type=int,default=64)
+    p.add_argument("--bands",type=int,default=16)
+    p.add_argument("--shingle-size",type=int,default=5)
+    p.add_argument("--pretty",action="store_true")
+    p.set_defaults(func=dedupe)
+
+    p=subparsers.add_parser("select",help="流式选出最好的第start到start+k个条目")
+    p.add_argument("json_file")
+    p.add_argument("des_file")
+    p.add_argument("k",type=int)
+    p.add_argument("--start",type=int,default=0)
+    p.add_argument("--by",default="score",choices=["score","attribute_num"])
+    p.add_argument("--pretty",action="store_true")
+    p.set_defaults(func=select)
+
+    p=subparsers.add_parser("cut",help="截取[start,end)之间的条目")
+    p.add_argument("data_file")
+    p.add_argument("des_file")
+    p.add_argument("start",type=int)
+    p.add_argument("end",type=int)
+    p.add_argument("--pretty",action="store_true")
+    p.set_defaults(func=cut)
+
+    p=subparsers.add_parser("shuffle",help="在外存中随机打乱条目，固定种子可复现")
+    p.add_argument("json_file")
+    p.add_argument("des_file")
+    p.add_argument("--seed",type=int,default=0)
+    p.add_argument("--max-bucket-mb",type=int,default=64,help="一次读入内存的桶的最大大小")
+    p.add_argument("--pretty",action="store_true")
+    p.set_defaults(func=shuffle)
+
+    p=subparsers.add_parser("split",help="按人名的哈希流式切分，同一个人总在同一个文件中")
+    p.add_argument("json_file")
+    p.add_argument("des_files",nargs="+",help="各切分的文件；--shards时为一个带{}的文件名模板")
+    p.add_argument("--rate",type=float,nargs="+",default=None,help="各文件的比例，默认8:1:1")
+    p.add_argument("--shards",type=int,default=None,help="分成的片数")
+    p.add_argument("--seed",type=int,default=0)
+    p.add_argument("--pretty",action="store_true")
+    p.set_defaults(func=split)
+
+    p=subparsers.add_parser("to-mrc",help="造mrc数据，按8:1:1分为train、test、dev")
+    p.add_argument("json_file")
+    p.add_argument("des_mrc_dir")
+    p.add_argument("--mode",default="BIOES",choices=["BIO","BIOES"])
+    p.add_argument("--sep",default="\t")
+    p.add_argument("--stream",action="store_true",help="边造边写，不把样本读入内存，按人名的哈希分配")
+    p.add_argument("--seed",type=int,default=0)
+    p.add_argument("--shuffle",action="store_true",help="--stream时在外存中打乱样本顺序")
+    p.add_argument("--all",action="store_true",help="造全部的数据，包括负样例")
+    p.add_argument("--compact",action="store_true",help="--all时只保存紧凑格式")
+    p.set_defaults(func=to_mrc)
+
+    p=subparsers.add_parser("to-bio",help="造序列标注数据")
+    p.add_argument("json_file")
+    p.add_argument("BIO_file")
+    p.add_argument("--mode",default="BIOES",choices=["BIO","BIOES"])
+    p.add_argument("--sep",default="\t")
+    p.set_defaults(func=to_bio)
+
+    p=subparsers.add_parser("stats",help="打印条目数、属性分布等统计信息")
+    p.add_argument("json_file")
+    p.add_argument("--approx",action="store_true",help="近似统计，内存有界，附带高频值、不同值数量和误差")
+    p.set_defaults(func=stats)
+
+    p=subparsers.add_parser("evaluate",help="比较两个infobox，计算各属性的P、R、F")
+    p.add_argument("json_file")
+    p.add_argument("des_file",help="逐条写入不相等的属性值对")
+    p.add_argument("--processes",type=int,default=1)
+    p.add_argument("--chunk-size",type=int,default=1000)
+    p.add_argument("--max-samples",type=int,default=None,help="每个属性最多写入的不相等的对数")
+    p.add_argument("--lenient",action="store_true",help="日期另外按粒度宽松比较，单独报告lenient_P、lenient_R、lenient_F")
+    p.set_defaults(func=evaluate)
+
+    p=subparsers.add_parser("make",help="按流程造全部数据，没变的阶段自动跳过")
+    p.add_argument("--para",action="store_true",help="造全部人物介绍数据")
+    p.add_argument("--processes",type=int,default=1)
+    p.add_argument("--force",nargs="*",default=[],help="不管缓存一定重跑的阶段")
+    p.set_defaults(func=make)
+    return parser
+
+def main(argv=None):
+    args=get_parser().parse_args(argv)
+    args.func(args)
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,155 @@
+# coding:utf-8
+
+"""
+数据构造流程
+每个阶段声明输入文件、输出文件和参数，阶段之间的依赖由文件推出
+阶段的键为 输入文件内容、参数、代码版本 的哈希，键没变且输出没被改动时跳过该阶段
+上游重跑但输出内容没变时，下游同样跳过
+用法：
+    Pipeline([
+        Stage("process",process_remote_data,["a.json"],"b.json"),
+        Stage("cut",cut_json_data,["b.json"],"c.json",{"start_idx":0,"end_idx":100}),
+    ]).run()
+"""
+
+import os
+import sys
+import json
+import hashlib
+from tools import file_digest
+
+
+class Stage():
+
+    def __init__(self,name,func,inputs,output,params=None,options=None,directory=False,version=""):
+        """
+        运行时调用 func(*inputs,output,**params,**options)
+        :param name: 阶段名称，唯一
+        :param inputs: 输入文件列表
+        :param output: 输出文件（或目录）
+        :param params: 影响结果的参数，计入键
+        :param options: 不影响结果的参数（如进程数），不计入键
+        :param directory: 输出是否为目录，为True时运行前先建好目录
+        :param version: 代码版本，默认用func所在目录下已导入模块的源文件内容
+        """
+        self.name=name
+        self.func=func
+        self.inputs=list(inputs)
+        self.output=output
+        self.params=params or dict()
+        self.options=options or dict()
+        self.directory=directory
+        self.version=version
+
+    def code_files(self):
+        """func所在目录下已导入的模块（不含__main__）"""
+        root=os.path.dirname(os.path.abspath(sys.modules[self.func.__module__].__file__))
+        files=set()
+        for name,module in list(sys.modules.items()):
+            filename=getattr(module,"__file__",None)
+            if name!="__main__" and filename and os.path.dirname(os.path.abspath(filename))==root:
+                files.add(os.path.abspath(filename))
+        return sorted(files)
+
+    def run(self):
+        if self.directory:os.makedirs(self.output,exist_ok=True)
+        elif os.path.dirname(self.output):os.makedirs(os.path.dirname(self.output),exist_ok=True)
+        self.func(*self.inputs,self.output,**self.params,**self.options)
+
+
+class Pipeline():
+
+    def __init__(self,stages,cache_dir="output/cache/pipeline"):
+        self.cache_dir=cache_dir
+        self.stages={stage.name:stage for stage in stages}
+        if len(self.stages)!=len(stages):raise Exception("阶段名称重复")
+        producers=dict()  #输出文件——>阶段名称
+        for stage in stages:
+            if stage.output in producers:raise Exception("多个阶段输出到同一文件："+stage.output)
+            producers[stage.output]=stage.name
+        self.deps={stage.name:[producers[i] for i in stage.inputs if i in producers] for stage in stages}
+        self.order=[]  #按依赖排序，没有依赖关系的保持声明顺序
+        visiting=set()
+        def visit(name):
+            if name in self.order:return
+            if name in visiting:raise Exception("阶段之间有环："+name)
+            visiting.add(name)
+            for dep in self.deps[name]:visit(dep)
+            visiting.discard(name)
+            self.order.append(name)
+        for stage in stages:visit(stage.name)
+        self.digest_file=os.path.join(cache_dir,"digests.json")
+        self.digests=self.load_json(self.digest_file) or dict()
+
+    def load_json(self,filename):
+        if not os.path.exists(filename):return None
+        with open(filename,encoding='utf-8')as file:return json.load(file)
+
+    def save_json(self,data,filename):
+        os.makedirs(self.cache_dir,exist_ok=True)
+        with open(filename+".tmp",'w',encoding='utf-8')as file:json.dump(data,file,ensure_ascii=False,indent=4)
+        os.replace(filename+".tmp",filename)
+
+    def digest(self,path):
+        """
+        文件或目录内容的哈希，文件的修改时间和大小没变时直接用上次算的哈希
+        目录为其中所有文件的相对路径和哈希
+        """
+        if os.path.isdir(path):
+            sha1=hashlib.sha1()
+            for root,dirs,files in sorted(os.walk(path)):
+                dirs.sort()
+                for filename in sorted(files):
+                    filename=os.path.join(root,filename)
+                    sha1.update((os.path.relpath(filename,path)+"\0"+self.digest(filename)+"\0").encode("utf-8"))
+            return sha1.hexdigest()
+        key=os.path.abspath(path)
+        stat=os.stat(path)
+        cached=self.digests.get(key)
+        if cached and cached[:2]==[stat.st_mtime_ns,stat.st_size]:return cached[2]
+        digest=file_digest(path)
+        self.digests[key]=[stat.st_mtime_ns,stat.st_size,digest]
+        return digest
+
+    def stage_key(self,stage):
+        content={
+            "func":stage.func.__module__+"."+stage.func.__qualname__,
+            "inputs":[[i,self.digest(i)] for i in stage.inputs],
+            "output":stage.output,
+            "params":stage.params,
+            "code":stage.version or [self.digest(i) for i in stage.code_files()],
+        }
+        return hashlib.sha1(json.dumps(content,sort_keys=True,ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def up_to_date(self,stage,key):
+        manifest=self.load_json(os.path.join(self.cache_dir,stage.name+".json"))
+        return (manifest is not None and manifest["key"]==key and os.path.exists(stage.output)
+                and self.digest(stage.output)==manifest["output"])
+
+    def run(self,targets=None,force=()):
+        """
+        :param targets: 要得到的阶段，None为全部，会连同其上游一起运行
+        :param force: 不管缓存一定重跑的阶段
+        :return: 实际运行了的阶段
+        """
+        needed=set()
+        def collect(name):
+            if name in needed:return
+            needed.add(name)
+            for dep in self.deps[name]:collect(dep)
+        for name in (self.order if targets is None else targets):collect(name)
+
+        ran=[]
+        for name in self.order:
+            if name not in needed:continue
+            stage=self.stages[name]
+            key=self.stage_key(stage)
+            if name not in force and self.up_to_date(stage,key):
+                print("跳过：",name)
+                continue
+            print("运行：",name)
+            stage.run()
+            self.save_json({"key":key,"output":self.digest(stage.output)},os.path.join(self.cache_dir,name+".json"))
+            self.save_json(self.digests,self.digest_file)
+            ran.append(name)
+        return ran
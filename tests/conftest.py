@@ -0,0 +1,5 @@
+import os
+import sys
+
+#模块都在仓库根目录下
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
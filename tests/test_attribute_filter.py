@@ -0,0 +1,255 @@
+# coding:utf-8
+
+import json
+import os
+
+import pytest
+
+import attribute_filter
+import tools
+from attribute_filter import (
+    AttributeInterface,BirthDate,DeathDate,Height,SentenceScanner,Weight,evaluate_two_infobox,get_remote_attributes,parse_date,pattern_cache_info,
+    prepare_vocabs,remote_supervision,remote_supervision_para
+)
+
+
+@pytest.fixture(params=[BirthDate,DeathDate])
+def date_attribute(request):
+    return request.param()
+
+
+@pytest.mark.parametrize("value,filtered",[
+    ("1985年至1990年代","1985年"),
+    ("1980年代","1980年"),
+    ("20世纪80年代","20世纪80年"),
+    ("上个世纪八十年代初","上个世纪八十年"),
+    ("80年代","80年代"),
+    ("公元1125年3月","公元1125年"),
+    ("1990年05月03日出生","1990年05月03日"),
+])
+def test_filter_keeps_pattern_priority(date_attribute,value,filtered):
+    assert date_attribute.filter(value)==filtered
+
+
+@pytest.mark.parametrize("value1,value2,equal",[
+    ("1985年5月","1985年",True),
+    ("20世纪80年代","20世纪",True),
+    ("1990年5月3日","1990-5",True),
+    ("1985年","80年代",False),
+    ("1985年","20世纪",False),
+    ("一九九〇年五月","1990年5月3日",False),
+    ("1990年","1991年",False),
+])
+def test_equal_compares_digit_strings(date_attribute,value1,value2,equal):
+    assert date_attribute.equal(value1,value2)==equal
+    assert date_attribute.equal(value2,value1)==equal
+
+
+def test_normalize(date_attribute):
+    assert date_attribute.normalize(["1990年5月3日","1990年05月","1990年","1989年"])=="1990年5月3日"
+    assert date_attribute.normalize(["80年代","1985年","1985年"])=="1985"
+    assert date_attribute.normalize(["不详"]) is None
+
+
+@pytest.mark.parametrize("value,key",[
+    ("1980年代",(20,8)),
+    ("一九八〇年代",(20,8)),
+    ("80年代",(20,8)),
+    ("二十世纪80年代",(20,8)),
+    ("上个世纪八十年代初",(20,8)),
+    ("2000年代",(21,0)),
+    ("公元前50年代",(-1,5)),
+    ("公元前3世纪",(-3,)),
+    ("公元1125年3月",(12,2,5,3)),
+    ("公元前210年",(-3,1,0)),
+    ("公元前210年5月3日",(-3,1,0,5,3)),
+    ("1990年05月03日出生",(20,9,0,5,3)),
+    ("一九九〇年五月三日",(20,9,0,5,3)),
+    ("1990-05-03",(20,9,0,5,3)),
+    ("1990年腊月12日",(20,9,0,12,12)),
+])
+def test_lenient_key(date_attribute,value,key):
+    assert date_attribute.lenient_key(value)==key
+
+
+def test_lenient_key_fallback(date_attribute):
+    #过滤不出日期，四个数字也解析不了，退回到依次当作年、月、日
+    assert parse_date("90 5 3 12") is None
+    assert date_attribute.lenient_key("90 5 3 12")==(1,9,0,5,3,12)
+    assert date_attribute.lenient_equal("90 5 3 12","公元90年5月")
+    assert date_attribute.lenient_key("不详")==()
+
+
+@pytest.mark.parametrize("value1,value2,equal",[
+    ("20世纪80年代","20世纪",True),
+    ("1985年","80年代",True),
+    ("1985年5月","二十世纪80年代",True),
+    ("1985年","90年代",False),
+    ("一九九〇年五月","1990年5月3日",True),
+    ("1990年","1991年",False),
+    ("公元前210年","210年",False),
+])
+def test_lenient_equal_by_granularity(date_attribute,value1,value2,equal):
+    assert date_attribute.lenient_equal(value1,value2)==equal
+    assert date_attribute.lenient_equal(value2,value1)==equal
+
+
+def test_evaluate_reports_lenient_dates_separately(tmp_path):
+    items=[
+        {"gold":{"出生日期":"1985年5月3日"},"predict":{"出生日期":["1985年5月"]}},
+        #predict先归一化成数字串，粗粒度的值放在gold
+        {"gold":{"出生日期":"80年代"},"predict":{"出生日期":["1985年"]}},
+        {"gold":{"出生日期":"1990年"},"predict":{"出生日期":["一九九〇年"]}},
+        {"gold":{"出生日期":"1990年"},"predict":{"出生日期":["1991年"]}},
+    ]
+    json_file=tmp_path/"model.json"
+    json_file.write_text("\n".join(json.dumps(item,ensure_ascii=False) for item in items),encoding="utf-8")
+    strict=evaluate_two_infobox(str(json_file),str(tmp_path/"strict.json"))["出生日期"]
+    assert strict["right_count"]==1 and "lenient_right_count" not in strict
+    for processes in [1,2]:
+        result=evaluate_two_infobox(str(json_file),str(tmp_path/"lenient.json"),processes=processes,chunk_size=1,lenient=True)
+        assert {key:value for key,value in result["出生日期"].items() if not key.startswith("lenient")}==strict
+        assert result["出生日期"]["lenient_right_count"]==3 and result["出生日期"]["lenient_F"]=="75.0%"
+        assert "lenient_right_count" not in result["身高"]
+        #不相等的对只按equal算
+        assert (tmp_path/"lenient.json").read_text(encoding="utf-8")==(tmp_path/"strict.json").read_text(encoding="utf-8")
+
+
+vocabs={
+    "country":["中国","美国","日本","英国"],
+    "birthplace":["北京","上海","浙江杭州","湖南长沙"],
+    "school":["北京大学","清华大学","复旦大学"],
+    "nation":["汉","回","满","苗"],
+}
+
+def make_person(i):
+    country=vocabs["country"][i%4]
+    birthplace=vocabs["birthplace"][i%4]
+    school=vocabs["school"][i%3]
+    return {
+        "name":"人物%d"%i,
+        "summary":"人物%d，%s人，出生于%s，毕业于%s，%d年%d月%d日出生。"%(i,country,birthplace,school,1950+i%50,i%12+1,i%28+1),
+        #带分隔符的属性值要用词表过滤
+        "infobox":{"国籍":country+"、"+country,"出生地":birthplace+"、"+birthplace,"毕业院校":school+"、"+school,"民族":"汉族",
+                   "出生日期":"%d年%d月%d日"%(1950+i%50,i%12+1,i%28+1)},
+        "para":["早年经历：他在%s度过童年。"%birthplace,"后来考入%s。"%school],
+    }
+
+@pytest.fixture
+def supervision_dir(tmp_path,monkeypatch):
+    """只有词表来源文件和人物数据、没有词表缓存的工作目录"""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("output")
+    for name,words in vocabs.items():
+        with open("output/%s_vocab.json"%name,"w",encoding="utf-8")as file:json.dump(words,file,ensure_ascii=False)
+    with open("person.json","w",encoding="utf-8")as file:
+        for i in range(120):file.write(json.dumps(make_person(i),ensure_ascii=False)+"\n")
+    #共享的属性对象和进程内的词表都清空，从没有缓存开始
+    monkeypatch.setattr(tools,"vocab_cache",dict())
+    for attribute in get_remote_attributes():monkeypatch.setattr(attribute,"_vocab",None)
+    return tmp_path
+
+
+def test_remote_supervision_processes_build_vocab_cache_once(supervision_dir):
+    assert not os.path.exists("output/cache")
+    remote_supervision("person.json","para.json",processes=4,chunk_size=10)
+    assert sorted(os.listdir("output/cache"))==["birthplace.pkl","country.pkl","nation.pkl","school.pkl"]
+    remote_supervision("person.json","single.json")
+    with open("para.json",encoding="utf-8")as file1,open("single.json",encoding="utf-8")as file2:
+        assert file1.read()==file2.read()
+    assert len(list(tools.iter_json_data("single.json")))==120
+
+
+@pytest.mark.parametrize("supervise",[remote_supervision,remote_supervision_para])
+def test_remote_supervision_statistics_start_from_zero(supervision_dir,supervise):
+    def statistics():
+        return [dict(attribute.statistics) for attribute in get_remote_attributes()]
+    supervise("person.json","first.json")
+    first=statistics()
+    assert any(any(values.values()) for values in first)
+    supervise("person.json","second.json")
+    assert statistics()==first
+
+
+@pytest.mark.parametrize("supervise,processes",[(remote_supervision,1),(remote_supervision,3),(remote_supervision_para,1),(remote_supervision_para,3)])
+def test_remote_supervision_resumes_from_checkpoint(supervision_dir,monkeypatch,capsys,supervise,processes):
+    def statistics():
+        return [dict(attribute.statistics) for attribute in get_remote_attributes()]
+    supervise("person.json","full.json")
+    full=statistics()
+
+    #读到第100个item时中断，多进程时已经读入的块有的还没处理完
+    def interrupted(data):
+        for i,item in enumerate(data):
+            if i==100:raise KeyboardInterrupt
+            yield item
+    with monkeypatch.context()as patch:
+        patch.setattr(attribute_filter,"progress",interrupted)
+        with pytest.raises(KeyboardInterrupt):
+            supervise("person.json","resumed.json",processes=processes,chunk_size=10,checkpoint_every=20)
+    done=tools.Checkpoint("resumed.json.ckpt").load()["done"]
+    assert 0<done<=100 and done%20==0
+
+    capsys.readouterr()
+    supervise("person.json","resumed.json",processes=processes,chunk_size=10,checkpoint_every=20)
+    assert "从断点继续，已处理： %d"%done in capsys.readouterr().out
+    with open("full.json",encoding="utf-8")as file1,open("resumed.json",encoding="utf-8")as file2:
+        assert file1.read()==file2.read()
+    assert statistics()==full
+    assert not os.path.exists("resumed.json.ckpt") and not os.path.exists("resumed.json.part")
+
+
+def test_remote_supervision_checkpoint_rejects_pretty_before_work(supervision_dir):
+    with pytest.raises(Exception,match="pretty"):
+        remote_supervision("person.json","pretty.json",pretty=True,checkpoint_every=20)
+    assert not os.path.exists("pretty.json") and not os.path.exists("pretty.json.ckpt")
+    #先分段写json lines，最后才分桶，可以用缩进格式
+    remote_supervision_para("person.json","para.json",pretty=True,checkpoint_every=20)
+    remote_supervision_para("person.json","plain.json",pretty=True)
+    with open("para.json",encoding="utf-8")as file1,open("plain.json",encoding="utf-8")as file2:
+        assert file1.read()==file2.read()
+
+
+def test_vocab_source_values_released_after_vocabs_built(supervision_dir,monkeypatch):
+    #出生地词表从result2.json建立，另外两个词表用不到收集的值
+    monkeypatch.setattr(attribute_filter,"vocab_source_values",dict())
+    os.remove("output/birthplace_vocab.json")
+    with open("result2.json","w",encoding="utf-8")as file:
+        for i in range(20):file.write(json.dumps(make_person(i),ensure_ascii=False)+"\n")
+    attributes=get_remote_attributes()
+    birthplace=next(attribute for attribute in attributes if attribute.get_name()=="出生地")
+    birthplace.vocab
+    assert list(attribute_filter.vocab_source_values["result2.json"])==["毕业院校","民族"]
+    prepare_vocabs(attributes)
+    assert attribute_filter.vocab_source_values=={}
+
+
+def test_compiled_patterns_are_shared_per_class(monkeypatch):
+    monkeypatch.setattr(AttributeInterface,"compiled_patterns",dict())
+    before=dict(pattern_cache_info)
+    first=Height().get_compiled_patterns("filter")
+    assert first and all(hasattr(pattern,"search") for pattern in first)
+    assert Height().get_compiled_patterns("filter") is first
+    assert pattern_cache_info["miss"]==before.get("miss",0)+1
+    assert pattern_cache_info["compile"]==before.get("compile",0)+len(first)
+    assert "hit" not in pattern_cache_info
+
+
+@pytest.mark.parametrize("sentence",[
+    "1990年5月3日出生，身高180cm",
+    "他于1985年出生在北京，身高1.75米，体重70kg。",
+    "张三（1920年—2001年），身高175厘米",
+])
+def test_sentence_scanner_spans_are_value_offsets(sentence):
+    result=SentenceScanner([BirthDate(),DeathDate(),Height(),Weight()]).scan(sentence)
+    spans=[span for values in result.values() for span in values]
+    assert spans
+    #属性值取自全角转换后的句子，转换不改变长度
+    converted=tools.cached_strB2Q(sentence)
+    assert len(converted)==len(sentence)
+    for start,end,value in spans:assert converted[start:end]==value
+
+
+def test_sentence_scanner_example():
+    assert SentenceScanner([BirthDate(),Height()]).scan("1990年5月3日出生，身高180cm")=={
+        "出生日期":[(0,9,"1990年5月3日"),(14,17,"180")],"身高":[(14,17,"180")]}
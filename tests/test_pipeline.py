@@ -0,0 +1,74 @@
+# coding:utf-8
+
+import os
+
+import pytest
+
+from pipeline import Pipeline,Stage
+
+
+def upper(source,des):
+    with open(source,encoding="utf-8")as file1,open(des,"w",encoding="utf-8")as file2:file2.write(file1.read().upper())
+
+def repeat(source,des,times=1,processes=1):
+    with open(source,encoding="utf-8")as file1,open(des,"w",encoding="utf-8")as file2:file2.write(file1.read()*times)
+
+
+@pytest.fixture
+def workdir(tmp_path,monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open("a.txt","w",encoding="utf-8")as file:file.write("abc")
+    return tmp_path
+
+def make_pipeline(times=2,processes=1):
+    #阶段顺序故意打乱，由文件推出依赖
+    return Pipeline([
+        Stage("repeat",repeat,["b.txt"],"c.txt",{"times":times},{"processes":processes},version="1"),
+        Stage("upper",upper,["a.txt"],"b.txt",version="1"),
+    ])
+
+def read(filename):
+    with open(filename,encoding="utf-8")as file:return file.read()
+
+
+def test_pipeline_skips_stages_that_are_up_to_date(workdir):
+    assert make_pipeline().run()==["upper","repeat"]
+    assert read("c.txt")=="ABCABC"
+    assert make_pipeline().run()==[]
+    #不影响结果的参数不计入键
+    assert make_pipeline(processes=4).run()==[]
+    assert make_pipeline(times=3).run()==["repeat"]
+    assert read("c.txt")=="ABCABCABC"
+
+
+def test_pipeline_reruns_when_input_or_output_changes(workdir):
+    make_pipeline().run()
+    #输入内容变了才重跑，上游输出没变时下游跳过
+    with open("a.txt","w",encoding="utf-8")as file:file.write("ABC")
+    assert make_pipeline().run()==["upper"]
+    os.utime("a.txt",ns=(1,1))
+    assert make_pipeline().run()==[]
+    with open("a.txt","w",encoding="utf-8")as file:file.write("xyz")
+    assert make_pipeline().run()==["upper","repeat"]
+    assert read("c.txt")=="XYZXYZ"
+    #输出被改动或删除也重跑
+    with open("c.txt","w",encoding="utf-8")as file:file.write("changed")
+    assert make_pipeline().run()==["repeat"]
+    os.remove("b.txt")
+    assert make_pipeline().run()==["upper"]
+
+
+def test_pipeline_targets_and_force(workdir):
+    assert make_pipeline().run(targets=["upper"])==["upper"]
+    assert not os.path.exists("c.txt")
+    assert make_pipeline().run(force=["upper"])==["upper","repeat"]
+    assert make_pipeline().run(force=["upper"])==["upper"]
+
+
+@pytest.mark.parametrize("stages,message",[
+    ([Stage("s",upper,["a.txt"],"b.txt"),Stage("s",upper,["b.txt"],"c.txt")],"阶段名称重复"),
+    ([Stage("s1",upper,["a.txt"],"b.txt"),Stage("s2",upper,["a.txt"],"b.txt")],"同一文件"),
+    ([Stage("s1",upper,["c.txt"],"b.txt"),Stage("s2",upper,["b.txt"],"c.txt")],"有环"),
+])
+def test_pipeline_rejects_invalid_stages(stages,message):
+    with pytest.raises(Exception,match=message):Pipeline(stages)
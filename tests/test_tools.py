@@ -0,0 +1,262 @@
+# coding:utf-8
+
+import json
+import os
+import random
+from multiprocessing import Pool
+from array import array
+
+import pytest
+
+import tools
+from tools import AhoCorasick,MRCAllData,ValueTagger,json2mrc,NearDuplicateDetector,SplitWriter,iter_json_data,json2mrc_all,load_vocab,mrc_all_attributes,select_top_items
+
+
+@pytest.mark.parametrize("chunk_size",[1,2,3,5,7,64])
+def test_iter_json_data_numbers_cut_at_chunk_boundary(tmp_path,chunk_size):
+    values=[1.5,12,3.25,-4e-3,1000000,0.5,{"a":[1.25,2]},"12",7]
+    array_file=tmp_path/"array.json"
+    array_file.write_text(json.dumps(values),encoding="utf-8")
+    assert list(iter_json_data(str(array_file),chunk_size=chunk_size))==values
+
+    lines_file=tmp_path/"lines.json"
+    lines_file.write_text("\n".join(json.dumps(i) for i in values),encoding="utf-8")
+    assert list(iter_json_data(str(lines_file),chunk_size=chunk_size))==values
+
+
+@pytest.mark.parametrize("chunk_size",[1,2,3,4,5,6,7,8,9,10,13])
+def test_iter_json_data_values_cut_anywhere(tmp_path,chunk_size):
+    values=[{"a":"x\u00e9y\\n\\\"q","b":[1.5e-3,-2,True,False,None],"c":{}},"s中",12.25,[],"\\u4e2d"]
+    array_file=tmp_path/"array.json"
+    array_file.write_text(json.dumps(values,ensure_ascii=True),encoding="utf-8")
+    assert list(iter_json_data(str(array_file),chunk_size=chunk_size))==values
+    lines_file=tmp_path/"lines.json"
+    lines_file.write_text("\n".join(json.dumps(i,ensure_ascii=False) for i in values),encoding="utf-8")
+    assert list(iter_json_data(str(lines_file),chunk_size=chunk_size))==values
+
+
+@pytest.mark.parametrize("bad_line,column",[('{"a":1,,"b":2}',8),('{"a":tx}',6),('{"a":"b"} x',11)])
+def test_iter_json_data_malformed_record_reports_file_position(tmp_path,bad_line,column):
+    lines=[json.dumps({"id":i}) for i in range(2000)]
+    lines[1000]=bad_line
+    text="\n".join(lines)
+    json_file=tmp_path/"lines.json"
+    json_file.write_text(text,encoding="utf-8")
+    items=[]
+    with pytest.raises(json.JSONDecodeError) as info:
+        for item in iter_json_data(str(json_file),chunk_size=64):items.append(item)
+    if bad_line.endswith(" x"):assert len(items)==1001
+    else:assert len(items)==1000
+    assert (info.value.lineno,info.value.colno)==(1001,column)
+    assert info.value.pos==text.index(bad_line)+column-1
+
+
+def test_iter_json_data_number_without_separator_is_split(tmp_path):
+    #"1." 后接 "3.5" 读到末尾前不能先返回1
+    json_file=tmp_path/"numbers.json"
+    json_file.write_text("12 1.5 3.5",encoding="utf-8")
+    assert list(iter_json_data(str(json_file),chunk_size=2))==[12,1.5,3.5]
+
+
+def test_near_duplicate_detector_checks_every_representative_in_bucket():
+    #B的第一段签名与先加入的A相同，只能通过这一段找到B
+    detector=NearDuplicateDetector(threshold=0.75,num_perm=4,bands=2)
+    detector.insert("A",array("I",[1,2,3,4]))
+    detector.insert("B",array("I",[1,2,9,9]))
+    assert detector.query(array("I",[1,2,9,5]))==("B",0.75)
+
+
+def test_split_writer_accepts_rates_with_rounding_error(tmp_path):
+    filenames=[str(tmp_path/name) for name in ("train.txt","test.txt","dev.txt")]
+    with SplitWriter(filenames,[0.7,0.2,0.1]) as writer:
+        for i in range(100):writer.write(str(i),key=i)
+    assert sum(writer.counts)==100
+    with pytest.raises(Exception):SplitWriter(filenames,[0.7,0.2,0.2])
+
+
+def test_mrc_all_data_closes_file(tmp_path):
+    json_file=tmp_path/"data.json"
+    json_file.write_text(json.dumps({"name":"张三","summary":["张三是中国人。"],"infobox":{"国籍":"中国"}},ensure_ascii=False),
+                         encoding="utf-8")
+    json2mrc_all(str(json_file),str(tmp_path),compact=True)
+    with MRCAllData(str(tmp_path)) as data:
+        question,sentence,labels=data[len(mrc_all_attributes)-1]
+        assert sentence=="张三是中国人。" and data.file is not None
+    assert data.file is None
+
+
+def test_aho_corasick_priority_and_overlaps():
+    matcher=AhoCorasick(["北京","北京大学","京大","","北京"])
+    assert matcher.words==["北京","北京大学","京大"]
+    assert matcher.first("毕业于北京大学")=="北京"
+    assert matcher.find_all("毕业于北京大学")==["北京","北京大学","京大"]
+    assert sorted(matcher.iter_matches("北京大学"))==[(0,0),(0,1),(1,2)]
+    assert matcher.first("上海")is None and matcher.find_all("")==[]
+
+
+def test_aho_corasick_matches_brute_force():
+    rand=random.Random(0)
+    for _ in range(200):
+        words=["".join(rand.choice("abc") for _ in range(rand.randint(1,4))) for _ in range(rand.randint(1,8))]
+        text="".join(rand.choice("abcd") for _ in range(rand.randint(0,30)))
+        matcher=AhoCorasick(words)
+        expected=sorted((start,matcher.words.index(word)) for word in set(words)
+                        for start in range(len(text)) if text.startswith(word,start))
+        assert sorted(matcher.iter_matches(text))==expected
+        found=[word for word in matcher.words if word in text]
+        assert matcher.find_all(text)==found
+        assert matcher.first(text)==(found[0] if found else None)
+
+
+def test_value_tagger_example():
+    tagger=ValueTagger([("国籍","中国"),("出生地","北京")])
+    assert tagger.tag("中国北京人")==["中\tB-国籍","国\tE-国籍","北\tB-出生地","京\tE-出生地","人\tO"]
+
+
+def test_value_tagger_priority_and_longest():
+    values=[("国籍","中国"),("出生地","中国北京"),("民族","汉"),("身高",180)]
+    #同一位置取传入顺序靠前的，不是字符串的属性值忽略
+    assert ValueTagger(values).tag("中国北京汉族")==["中\tB-国籍","国\tE-国籍","北\tO","京\tO","汉\tS-民族","族\tO"]
+    assert ValueTagger(values,longest=True).tag("中国北京",mode="BIO")==[
+        "中\tB-出生地","国\tI-出生地","北\tI-出生地","京\tI-出生地"]
+    assert ValueTagger(values).tag("中北",sep=" ")==["中 O","北 O"]
+    assert ValueTagger([]).tag("")==[]
+
+
+def read_split_files(filenames,sep="\n\n"):
+    result=[]
+    for filename in filenames:
+        with open(filename,encoding="utf-8")as file:
+            text=file.read()
+        result.append(text.split(sep) if text else [])
+    return result
+
+
+def test_split_writer_is_reproducible_and_keeps_keys_together(tmp_path):
+    filenames=[str(tmp_path/name) for name in ("train.txt","test.txt","dev.txt")]
+    samples=[("人物%d"%(i%300),"样本%d"%i) for i in range(3000)]
+    with SplitWriter(filenames,seed=3) as writer:
+        for key,sample in samples:writer.write(sample,key=key)
+    first=read_split_files(filenames)
+    assert [len(i) for i in first]==writer.counts and sum(writer.counts)==3000
+    #同一个key总在同一个文件中
+    files_of_key=dict()
+    for index,split in enumerate(first):
+        for sample in split:files_of_key.setdefault(samples[int(sample[2:])][0],set()).add(index)
+    assert all(len(i)==1 for i in files_of_key.values())
+
+    #同样的种子结果相同，与写入顺序无关
+    with SplitWriter(filenames,seed=3) as writer:
+        for key,sample in reversed(samples):writer.write(sample,key=key)
+    assert [sorted(i) for i in read_split_files(filenames)]==[sorted(i) for i in first]
+
+
+def test_split_writer_random_assignment_follows_rate(tmp_path):
+    filenames=[str(tmp_path/name) for name in ("train.txt","test.txt","dev.txt")]
+    with SplitWriter(filenames,seed=0) as writer:
+        for i in range(10000):writer.write("样本%d"%i)
+    counts=writer.counts
+    assert abs(counts[0]-8000)<300 and abs(counts[1]-1000)<200 and abs(counts[2]-1000)<200
+    with SplitWriter(filenames,seed=0) as writer:
+        for i in range(10000):writer.write("样本%d"%i)
+    assert writer.counts==counts
+    with pytest.raises(Exception):SplitWriter(filenames,[0.5,0.5])
+
+
+def test_json2mrc_stream_writes_same_samples(tmp_path):
+    json_file=tmp_path/"data.json"
+    with open(json_file,"w",encoding="utf-8")as file:
+        for i in range(200):
+            item={"name":"人物%d"%i,"summary":["人物%d是中国人，出生于北京。"%i],"infobox":{"国籍":"中国","出生地":["北京","上海"]}}
+            file.write(json.dumps(item,ensure_ascii=False)+"\n")
+    names=("train.txt","test.txt","dev.txt")
+    for directory,kwargs in (("memory",{}),("stream",{"stream":True}),("shuffle",{"stream":True,"shuffle":True})):
+        (tmp_path/directory).mkdir()
+        json2mrc(str(json_file),str(tmp_path/directory),**kwargs)
+    samples={directory:read_split_files([str(tmp_path/directory/name) for name in names]) for directory in ("memory","stream","shuffle")}
+    assert sorted(sum(samples["stream"],[]))==sorted(sum(samples["memory"],[]))
+    assert len(sum(samples["stream"],[]))==400
+    #打乱只改变文件内的顺序，不改变分到哪个文件
+    assert [sorted(i) for i in samples["shuffle"]]==[sorted(i) for i in samples["stream"]]
+
+
+@pytest.fixture
+def vocab_dir(tmp_path,monkeypatch):
+    monkeypatch.setattr(tools,"vocab_cache",dict())
+    source=tmp_path/"vocab.json"
+    source.write_text(json.dumps(["北京","上海"],ensure_ascii=False),encoding="utf-8")
+    return tmp_path
+
+
+def load_counting(vocab_dir,builds,version=""):
+    source=str(vocab_dir/"vocab.json")
+    def build():
+        builds.append(1)
+        with open(source,encoding="utf-8")as file:return json.load(file)
+    return load_vocab("places",source,build,cache_dir=str(vocab_dir/"cache"),version=version)
+
+
+def test_load_vocab_uses_cache_until_source_or_version_changes(vocab_dir):
+    builds=[]
+    vocab=load_counting(vocab_dir,builds)
+    assert vocab.words==["北京","上海"] and vocab.matcher.first("去上海")=="上海" and len(builds)==1
+    assert load_counting(vocab_dir,builds) is vocab and len(builds)==1
+
+    #新进程：从pickle读取，不重建
+    tools.vocab_cache.clear()
+    assert load_counting(vocab_dir,builds).words==["北京","上海"] and len(builds)==1
+
+    #只改修改时间，内容哈希没变，不重建
+    source=vocab_dir/"vocab.json"
+    os.utime(source,ns=(1,1))
+    tools.vocab_cache.clear()
+    assert load_counting(vocab_dir,builds).source[1]==1 and len(builds)==1
+
+    #内容变了重建
+    source.write_text(json.dumps(["广州"],ensure_ascii=False),encoding="utf-8")
+    assert load_counting(vocab_dir,builds).words==["广州"] and len(builds)==2
+
+    #版本变了重建
+    tools.vocab_cache.clear()
+    load_counting(vocab_dir,builds,version="2")
+    assert len(builds)==3
+    tools.vocab_cache.clear()
+    load_counting(vocab_dir,builds,version="2")
+    assert len(builds)==3
+    assert os.listdir(vocab_dir/"cache")==["places.pkl"]
+
+
+def test_load_vocab_rebuilds_unreadable_or_old_cache(vocab_dir):
+    builds=[]
+    load_counting(vocab_dir,builds)
+    cache_file=vocab_dir/"cache"/"places.pkl"
+    cache_file.write_bytes(b"not a pickle")
+    tools.vocab_cache.clear()
+    assert load_counting(vocab_dir,builds).words==["北京","上海"] and len(builds)==2
+
+    #代码版本不同的缓存
+    vocab=load_counting(vocab_dir,builds)
+    vocab.version=("old",)
+    tools.vocab_cache.clear()
+    with open(cache_file,"wb")as file:__import__("pickle").dump(vocab,file)
+    load_counting(vocab_dir,builds)
+    assert len(builds)==3
+
+
+def build_cache_in_worker(vocab_dir):
+    tools.vocab_cache.clear()
+    return load_counting(vocab_dir,[]).words
+
+
+def test_load_vocab_concurrent_writers(vocab_dir):
+    with Pool(8)as pool:
+        assert pool.map(build_cache_in_worker,[vocab_dir]*32)==[["北京","上海"]]*32
+    assert os.listdir(vocab_dir/"cache")==["places.pkl"]
+
+
+@pytest.mark.parametrize("k,start",[(3,0),(3,4),(0,0),(0,5),(5,18),(30,0)])
+def test_select_top_items_matches_sorted_slice(k,start):
+    items=[random.Random(seed).randint(0,5) for seed in range(20)]
+    expected=sorted(enumerate(items),key=lambda pair:pair[1],reverse=True)[start:start+k]
+    assert select_top_items(enumerate(items),k,lambda pair:pair[1],start)==expected
+    assert select_top_items(iter(items),-2,int,1)==[]
@@ -1,18 +1,143 @@
 # coding:utf-8
 import json
 import re
+import math
 import random
-from collections import Counter
+import os
+import pickle
+import hashlib
+import heapq
+import tempfile
+import zlib
+from array import array
+from functools import lru_cache
+from bisect import bisect_right
+from collections import Counter,deque
+from itertools import islice
+try:
+    from re import _parser as sre_parse
+except ImportError:  # python3.10及以前
+    import sre_parse
 
 
-def get_json_data(json_file):
+number_tail_pattern=re.compile(r"[0-9.eE+\-]*\Z") #缓冲区末尾可能是被截断的数字的剩余部分
+literal_tail_pattern=re.compile(r"(t|tr|tru|f|fa|fal|fals|n|nu|nul)\Z") #缓冲区末尾可能是被截断的true、false、null
+
+def json_truncated(buffer,error):
+    """解析缓冲区出错是否可能只是因为条目被截断，是则应读入更多再解析，否则为格式错误"""
+    if error.pos>=len(buffer) or error.msg.startswith("Unterminated string"):return True
+    if error.msg.startswith("Invalid \\uXXXX escape"):return len(buffer)-error.pos<6
+    return bool(number_tail_pattern.match(buffer,error.pos) or literal_tail_pattern.match(buffer,error.pos))
+
+def json_file_error(error,offset,lineno,line_start):
+    """
+    把缓冲区中的解析错误转为文件中的位置
+    :param offset: 缓冲区开头在文件中的字符位置
+    :param lineno: 缓冲区开头所在的行号（从1开始）
+    :param line_start: 缓冲区开头所在行的行首在文件中的字符位置
+    """
+    pos=offset+error.pos
+    lineno+=error.doc.count("\n",0,error.pos)
+    last_newline=error.doc.rfind("\n",0,error.pos)
+    colno=error.pos-last_newline if last_newline>=0 else pos-line_start+1
+    new_error=json.JSONDecodeError(error.msg,error.doc,error.pos)
+    new_error.pos,new_error.lineno,new_error.colno=pos,lineno,colno
+    new_error.args=("%s: line %d column %d (char %d)"%(error.msg,lineno,colno,pos),)
+    return new_error
+
+def iter_json_data(json_file,chunk_size=1<<20):
+    """
+    逐条读取json文件中的条目，不把整个文件读入内存
+    支持两种格式：
+        顶层为列表的json文件（[{...},{...}]）
+        json lines文件（每行一个条目）
+    :param json_file: 目标文件
+    :param chunk_size: 每次读取的字符数
+    :return: 条目生成器
+    """
+    decoder=json.JSONDecoder()
+    offset,lineno,line_start=0,1,0  #缓冲区开头在文件中的位置，用于报错
     with open(json_file, 'r', encoding='utf-8')as file:
-        data=json.loads(file.read())
-    return data
+        buffer=file.read(chunk_size)
+        index=0
+        eof=not buffer
+        #跳过开头空白，判断文件格式
+        while True:
+            while index<len(buffer) and buffer[index].isspace():index+=1
+            if index<len(buffer) or eof:break
+            offset+=len(buffer)
+            lineno+=buffer.count("\n")
+            if "\n" in buffer:line_start=offset-(len(buffer)-buffer.rfind("\n")-1)
+            buffer,index=file.read(chunk_size),0
+            eof=not buffer
+        is_array=index<len(buffer) and buffer[index]=="["
+        if is_array:index+=1
+
+        while True:
+            #跳过空白和分隔符
+            while index<len(buffer) and (buffer[index].isspace() or (is_array and buffer[index]==",")):index+=1
+            if index<len(buffer) and is_array and buffer[index]=="]":return
+            if index<len(buffer):
+                try:
+                    item,end=decoder.raw_decode(buffer,index)
+                    #数字在缓冲区末尾可能被截断（如"12"、"1."后面还有"3.5"），后面只剩数字字符时读入更多再确认
+                    truncated=type(item) in (int,float) and number_tail_pattern.match(buffer,end)
+                    if not truncated or eof:
+                        yield item
+                        index=end
+                        continue
+                except json.JSONDecodeError as error:
+                    #只有可能是被截断时才读入更多，否则立即报错，不把文件余下的部分读进来
+                    if eof or not json_truncated(buffer,error):raise json_file_error(error,offset,lineno,line_start) from None
+            elif eof:
+                if is_array:raise json_file_error(json.JSONDecodeError("列表没有结束", buffer, index),offset,lineno,line_start)
+                return
+            chunk=file.read(chunk_size)
+            eof=not chunk
+            offset+=index
+            lineno+=buffer.count("\n",0,index)
+            if "\n" in buffer[:index]:line_start=offset-(index-buffer.rfind("\n",0,index)-1)
+            buffer,index=buffer[index:]+chunk,0
+
+def get_json_data(json_file):
+    return list(iter_json_data(json_file))
+
+def cut_json_data(data_file,des_file,start_idx,end_idx,pretty=False):
+    data=iter_json_data(data_file)
+    with JsonWriter(des_file,pretty=pretty) as writer:
+        writer.write_all(islice(data,start_idx,end_idx))
+
+def progress(iterable,**kwargs):
+    """
+    进度条，用到时才导入tqdm，没有安装tqdm时直接返回iterable
+    """
+    try:
+        from tqdm import tqdm
+    except ImportError:
+        return iterable
+    return tqdm(iterable,**kwargs)
 
-def cut_json_data(data_file,des_file,start_idx,end_idx):
-    data=get_json_data(data_file)
-    save_json(data[start_idx:end_idx],des_file)
+def chunked(iterable,size):
+    """把迭代器按size切成列表块"""
+    iterator=iter(iterable)
+    while True:
+        chunk=list(islice(iterator,size))
+        if not chunk:return
+        yield chunk
+
+def ordered_pool_map(func,iterable,processes,initializer=None,initargs=(),max_pending=None):
+    """
+    用进程池对iterable中的每个任务调用func，按输入顺序返回结果
+    与Pool.imap不同，最多只有max_pending个任务在排队，输入不会被一次读完
+    """
+    from multiprocessing import Pool
+    if max_pending is None:max_pending=processes*2
+    pending=deque()
+    with Pool(processes,initializer=initializer,initargs=initargs) as pool:
+        for task in iterable:
+            pending.append(pool.apply_async(func,(task,)))
+            if len(pending)>=max_pending:yield pending.popleft().get()
+        while pending:yield pending.popleft().get()
 
 def list_count_sort(l):
     """按list出现次数排序"""
@@ -50,6 +175,135 @@ def cut_data(data,rate="default"):
 
     return cutted_data
 
+def stable_hash(key,seed=0):
+    """与进程、PYTHONHASHSEED无关的64位哈希"""
+    return int.from_bytes(hashlib.blake2b((str(seed)+"\0"+str(key)).encode("utf-8"),digest_size=8).digest(),"big")
+
+def hash_fraction(key,seed=0):
+    """把key稳定地映射到[0,1)"""
+    return stable_hash(key,seed)/(1<<64)
+
+class SplitWriter():
+    """
+    把样本逐条分配到多个文件中（如train/test/dev），边生成边写，不在内存里保留整个数据集
+    每条样本用固定种子的随机数分配，结果可复现，比例默认8:1:1（期望比例，不是严格比例）
+    写入时给出key（如人名）则按key的哈希分配，同一个key总在同一个文件中，与顺序和其它样本无关
+    文件中样本之间用sep分隔，与"\n\n".join的结果格式相同
+    """
+
+    def __init__(self,filenames,rate="default",seed=0,sep="\n\n"):
+        if rate=="default":rate=[0.8,0.1,0.1]
+        elif not math.isclose(sum(rate),1): raise Exception("概率和不等于1")  #浮点数相加有误差，如0.7+0.2+0.1
+        if len(rate)!=len(filenames): raise Exception("文件数量与比率数量不一致")
+        self.bounds=[sum(rate[:i+1]) for i in range(len(rate))]
+        self.random=random.Random(seed)
+        self.seed=seed
+        self.sep=sep
+        self.counts=[0]*len(filenames)
+        self.files=[open(filename,'w',encoding='utf-8') for filename in filenames]
+
+    def assign(self,sample,key=None):
+        """返回样本分到的文件下标"""
+        r=self.random.random() if key is None else hash_fraction(key,self.seed)
+        for index,bound in enumerate(self.bounds):
+            if r<bound:return index
+        return len(self.bounds)-1
+
+    def write(self,sample,key=None):
+        index=self.assign(sample,key)
+        if self.counts[index]:self.files[index].write(self.sep)
+        self.files[index].write(sample)
+        self.counts[index]+=1
+
+    def close(self):
+        for file in self.files:file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+class ExternalShuffler():
+    """
+    外存随机打乱，结果对固定的seed可复现
+    每条记录随机分到num_buckets个临时文件中，全部加入后逐个桶读入内存打乱再输出
+    超过max_bucket_bytes的桶再随机分桶，所以同时在内存中的只有一个不超过max_bucket_bytes的桶
+    随机分桶后桶内打乱再依次拼接，得到的是均匀的随机排列
+    用法：
+        with ExternalShuffler(seed=0) as shuffler:
+            shuffler.add_all(records)
+            for record in shuffler:...
+    """
+
+    def __init__(self,seed=0,num_buckets=64,max_bucket_bytes=64<<20,max_depth=8,tmp_dir=None):
+        """
+        :param max_bucket_bytes: 一个桶的最大字节数（json lines），约为内存占用的上界的几分之一
+        :param max_depth: 再分桶的最大层数，单条记录过大时不再分
+        :param tmp_dir: 临时文件所在目录，默认为系统临时目录
+        """
+        self.seed=seed
+        self.num_buckets=num_buckets
+        self.max_bucket_bytes=max_bucket_bytes
+        self.max_depth=max_depth
+        self.random=random.Random(seed)
+        self.tmp_dir=tempfile.TemporaryDirectory(dir=tmp_dir)
+        self.files=[open(os.path.join(self.tmp_dir.name,"%d.json"%i),'w',encoding='utf-8') for i in range(num_buckets)]
+        self.count=0
+
+    def add(self,record):
+        self.files[self.random.randrange(self.num_buckets)].write(json.dumps(record,ensure_ascii=False)+"\n")
+        self.count+=1
+
+    def add_all(self,records):
+        for record in records:self.add(record)
+
+    def split(self,filename,seed):
+        """把一个桶再随机分成num_buckets个桶，返回各桶的文件名"""
+        rand=random.Random(seed)
+        filenames=[filename+".%d"%i for i in range(self.num_buckets)]
+        files=[open(i,'w',encoding='utf-8') for i in filenames]
+        with open(filename,encoding='utf-8')as file:
+            for line in file:files[rand.randrange(self.num_buckets)].write(line)
+        for file in files:file.close()
+        os.remove(filename)
+        return filenames
+
+    def iter_bucket(self,filename,seed,depth):
+        if os.path.getsize(filename)>self.max_bucket_bytes and depth<self.max_depth:
+            for i,sub_filename in enumerate(self.split(filename,seed+"/split")):
+                yield from self.iter_bucket(sub_filename,seed+"/"+str(i),depth+1)
+            return
+        with open(filename,encoding='utf-8')as file:lines=file.readlines()
+        os.remove(filename)
+        random.Random(seed).shuffle(lines)
+        for line in lines:yield json.loads(line)
+
+    def __iter__(self):
+        for file in self.files:file.close()
+        for i,file in enumerate(self.files):
+            yield from self.iter_bucket(file.name,str(self.seed)+"/"+str(i),1)
+        self.close()
+
+    def close(self):
+        for file in self.files:file.close()
+        self.tmp_dir.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+def shuffle_json_data(json_file,des_file,seed=0,pretty=False,**kwargs):
+    """
+    流式打乱json文件中的条目，内存占用见ExternalShuffler
+    :param kwargs: ExternalShuffler的参数
+    """
+    with ExternalShuffler(seed=seed,**kwargs) as shuffler:
+        shuffler.add_all(iter_json_data(json_file))
+        with JsonWriter(des_file,pretty=pretty) as writer:writer.write_all(shuffler)
+
 def sort_dict(source_dict,obj="value",reverse=True):
     """
     对字典排序，可按值或按键
@@ -66,7 +320,8 @@ def get_first_pattern(patterns,s):
     """返回模式列表中第一个匹配的模式，没有返回None"""
     if s:
         for pattern in patterns:
-            ret = re.search(pattern, s)
+            #支持已编译的模式，避免每次查re模块的缓存
+            ret = pattern.search(s) if isinstance(pattern,re.Pattern) else re.search(pattern, s)
             if ret:
                 return ret.group()
 
@@ -77,9 +332,339 @@ def save_json(data,filename):
     with open(filename, 'w', encoding='utf-8') as file:
         file.write(data)
 
+class JsonWriter():
+    """
+    逐条写入json数据，写完一条就落盘，不在内存中拼接整个文件
+    默认为json lines格式，每行一个紧凑的条目
+    pretty=True时输出与save_json相同的缩进列表格式
+    offset不为None时（只支持json lines）把已有文件截断到offset字节后接着写，用于从断点继续
+    用法：
+        with JsonWriter(filename) as writer:
+            writer.write(item)
+    """
+
+    def __init__(self,filename,pretty=False,offset=None):
+        if offset is None:self.file=open(filename,'w',encoding='utf-8')
+        else:
+            if pretty:raise Exception("缩进列表格式不支持续写")
+            os.truncate(filename,offset)
+            self.file=open(filename,'a',encoding='utf-8')
+        self.pretty=pretty
+        self.count=0
+
+    def tell(self):
+        """已写入的字节数，写入的内容先落盘"""
+        self.file.flush()
+        return self.file.tell()
+
+    def write(self,item):
+        if self.pretty:
+            line=json.dumps(item, sort_keys=True, indent=4, separators=(',', ': '), ensure_ascii=False)
+            line=line.replace("\n","\n    ") #作为列表元素再缩进一层
+            self.file.write(("[\n    " if self.count==0 else ",\n    ")+line)
+        else:
+            self.file.write(json.dumps(item, separators=(',', ':'), ensure_ascii=False)+"\n")
+        self.count+=1
+
+    def write_all(self,items):
+        for item in items:self.write(item)
+
+    def close(self):
+        if self.pretty:self.file.write("\n]" if self.count else "[]")
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+class Checkpoint():
+    """
+    断点文件，保存为json，先写临时文件再替换，中途退出也不会损坏
+    用法：
+        checkpoint=Checkpoint(des_file+".ckpt")
+        state=checkpoint.load()  #没有断点时为None
+        checkpoint.save({"done":100})
+        checkpoint.remove()     #正常结束后删除
+    """
+
+    def __init__(self,filename):
+        self.filename=filename
+
+    def load(self):
+        if not os.path.exists(self.filename):return None
+        with open(self.filename,encoding='utf-8')as file:return json.load(file)
+
+    def save(self,state):
+        with open(self.filename+".tmp",'w',encoding='utf-8')as file:json.dump(state,file,ensure_ascii=False)
+        os.replace(self.filename+".tmp",self.filename)
+
+    def remove(self):
+        if os.path.exists(self.filename):os.remove(self.filename)
+
+def write_json_buckets(items,des_file,key,reverse=True,pretty=False):
+    """
+    按整数键分桶写入，等价于按key稳定排序后保存，但不需要把所有条目放在内存中
+    每个桶先写到临时文件，最后按桶的顺序拼接
+    :param items: 条目迭代器
+    :param des_file: 结果文件
+    :param key: 条目 -> 整数
+    :param reverse: 是否从大到小
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        buckets=dict()
+        try:
+            for item in items:
+                k=key(item)
+                if k not in buckets:buckets[k]=JsonWriter(os.path.join(tmp_dir,"%d.json"%len(buckets)))
+                buckets[k].write(item)
+        finally:
+            for writer in buckets.values():writer.close()
+        with JsonWriter(des_file,pretty=pretty) as writer:
+            for k in sorted(buckets.keys(),reverse=reverse):
+                writer.write_all(iter_json_data(buckets[k].file.name))
+
+class AhoCorasick():
+    """
+    多模式匹配自动机（Aho-Corasick），对文本扫描一遍即可找出所有出现的词
+    词的优先级为传入的顺序，多个词命中时按优先级确定"第一个"，结果不依赖集合的遍历顺序
+    用法：
+        matcher=AhoCorasick(["北京","北京大学"])
+        matcher.first("毕业于北京大学")     ——> 北京
+        matcher.find_all("毕业于北京大学")  ——> ["北京","北京大学"]
+    """
+
+    def __init__(self,words):
+        self.words=[]            #去重后的词，下标即优先级
+        self.goto=[dict()]       #状态转移
+        self.fail=[0]            #失配指针
+        self.match=[-1]          #在该状态结束的词的下标，没有为-1
+        self.match_link=[-1]     #沿失配指针最近的有词结束的状态，没有为-1
+        index=dict()
+        for word in words:
+            if not word or word in index:continue
+            index[word]=len(self.words)
+            self.words.append(word)
+            node=0
+            for char in word:
+                if char not in self.goto[node]:
+                    self.goto[node][char]=len(self.goto)
+                    self.goto.append(dict())
+                    self.fail.append(0)
+                    self.match.append(-1)
+                    self.match_link.append(-1)
+                node=self.goto[node][char]
+            self.match[node]=index[word]
+
+        #按层建立失配指针
+        queue=deque(self.goto[0].values())
+        while queue:
+            node=queue.popleft()
+            fail=self.fail[node]
+            self.match_link[node]=fail if self.match[fail]>=0 else self.match_link[fail]
+            for char,child in self.goto[node].items():
+                fail=self.fail[node]
+                while fail and char not in self.goto[fail]:fail=self.fail[fail]
+                self.fail[child]=self.goto[fail].get(char,0)
+                queue.append(child)
+
+    def iter_matches(self,text):
+        """返回所有命中（起始位置，词下标），按结束位置先后"""
+        goto,fail,match,match_link=self.goto,self.fail,self.match,self.match_link
+        node=0
+        for end,char in enumerate(text,1):
+            while node and char not in goto[node]:node=fail[node]
+            node=goto[node].get(char,0)
+            hit=node if match[node]>=0 else match_link[node]
+            while hit>=0:
+                yield end-len(self.words[match[hit]]),match[hit]
+                hit=match_link[hit]
+
+    def find_all(self,text):
+        """返回文本中出现的所有词，按优先级排序"""
+        return [self.words[i] for i in sorted(set(i for _,i in self.iter_matches(text)))]
+
+    def first(self,text):
+        """返回文本中出现的优先级最高的词，没有返回None"""
+        best=min((i for _,i in self.iter_matches(text)),default=None)
+        if best is not None:return self.words[best]
+
+class ParaIndex():
+    """
+    item中所有para的检索结构，每个item只建一次，各属性共用
+    para用不会出现在属性值中的分隔符拼接成一个字符串，查找属性值时只在拼接后的文本上用str.find，
+    再用二分查找定位所在的段，不用在Python中逐段循环
+    """
+    sep="\x00"
+
+    def __init__(self,paras):
+        self.paras=paras or []
+        self.text=self.sep.join(self.paras)
+        self.starts=[] #每段在text中的起始位置
+        start=0
+        for para in self.paras:
+            self.starts.append(start)
+            start+=len(para)+1
+
+    def iter_containing(self,value):
+        """按先后顺序返回包含value的段的下标"""
+        if not value or self.sep in value:
+            for index,para in enumerate(self.paras):
+                if value in para:yield index
+            return
+        start=0
+        while True:
+            position=self.text.find(value,start)
+            if position<0:return
+            index=bisect_right(self.starts,position)-1
+            yield index
+            if index+1>=len(self.starts):return
+            start=self.starts[index+1]
+
+class Vocab():
+    """编译好的词表：保持顺序的词列表、用于精确查找的集合、AhoCorasick自动机"""
+
+    def __init__(self,words):
+        self.words=list(words)
+        self.word_set=set(self.words)
+        self.matcher=AhoCorasick(self.words)
+        self.source=None #（来源文件，修改时间，大小，内容哈希）
+        self.version=None #（代码版本，load_vocab的version）
+
+def file_digest(filename):
+    """文件内容的sha1"""
+    sha1=hashlib.sha1()
+    with open(filename,'rb')as file:
+        for block in iter(lambda:file.read(1<<20),b""):sha1.update(block)
+    return sha1.hexdigest()
+
+#进程内共享的词表，键为缓存文件
+vocab_cache=dict()
+
+@lru_cache(maxsize=1)
+def vocab_code_version():
+    """Vocab和AhoCorasick的代码的哈希，代码改了pickle中的对象结构可能不同，缓存随之失效"""
+    import inspect
+    return hashlib.sha1((inspect.getsource(Vocab)+inspect.getsource(AhoCorasick)).encode("utf-8")).hexdigest()
+
+def load_vocab(name,source_file,build,cache_dir="output/cache",version=""):
+    """
+    读取编译好的词表，同一进程内只加载一次，不同进程通过cache_dir中的pickle文件共用
+    来源文件的修改时间和大小没变时直接使用缓存，变了再比较内容哈希，内容也变了才调用build重建
+    缓存还记录了代码版本（Vocab、AhoCorasick的代码和version），版本不同或读不出来时同样重建
+    每个进程先写自己的临时文件再替换，多个进程同时写同一个缓存也不会出错
+    :param name: 词表名称，缓存文件为cache_dir/name.pkl
+    :param source_file: 词表的来源文件
+    :param build: 返回词列表的函数
+    :param version: build的规则改变时修改，使旧的缓存失效
+    :return: Vocab
+    """
+    cache_file=os.path.join(cache_dir,name+".pkl")
+    stat=os.stat(source_file)
+    signature=(source_file,stat.st_mtime_ns,stat.st_size)
+    code_version=(vocab_code_version(),version)
+    vocab=vocab_cache.get(cache_file)
+    if vocab is not None and vocab.source[:3]==signature and vocab.version==code_version:return vocab
+
+    vocab=None
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file,'rb')as file:vocab=pickle.load(file)
+        except Exception:vocab=None #旧版本或损坏的缓存
+        if vocab is not None and getattr(vocab,"version",None)!=code_version:vocab=None
+        if vocab is not None:
+            if vocab.source[:3]!=signature:
+                digest=file_digest(source_file)
+                if vocab.source[0]==source_file and vocab.source[3]==digest:vocab.source=signature+(digest,)
+                else:vocab=None
+            else:signature=None #缓存完全有效，不用重写
+    if vocab is None:
+        digest=file_digest(source_file)
+        vocab=Vocab(build())
+        vocab.source=(source_file,stat.st_mtime_ns,stat.st_size,digest)
+        vocab.version=code_version
+    if signature is not None:
+        os.makedirs(cache_dir,exist_ok=True)
+        fd,tmp_file=tempfile.mkstemp(dir=cache_dir,prefix=name+".",suffix=".tmp")
+        try:
+            with os.fdopen(fd,'wb')as file:pickle.dump(vocab,file,protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file,cache_file)
+        except BaseException:
+            os.remove(tmp_file)
+            raise
+    vocab_cache[cache_file]=vocab
+    return vocab
+
+def regex_required_literals(pattern):
+    """
+    找出正则表达式匹配成功时文本中必然出现的字面量，用于多模式扫描前的预筛选
+    :param pattern: 正则表达式字符串或编译后的模式
+    :return: 字面量组的列表，匹配成功时每组中至少有一个出现在文本中；无法确定时返回空列表
+    例：".{4,12}(出生|生)" ——> [{"出生","生"}]
+    """
+    def sequence_groups(items):
+        groups=[]
+        text=""
+        for op,av in items:
+            if op is sre_parse.LITERAL:
+                text+=chr(av)
+                continue
+            if text:groups.append({text})
+            text=""
+            if op is sre_parse.SUBPATTERN:
+                groups+=sequence_groups(av[-1])
+            elif op is sre_parse.BRANCH:
+                #每个分支都要有必然出现的字面量，取各分支最长的那组合并
+                group=set()
+                for branch in av[1]:
+                    branch_groups=sequence_groups(branch)
+                    if not branch_groups:
+                        group=None
+                        break
+                    group|=max(branch_groups,key=lambda g:min(len(i) for i in g))
+                if group:groups.append(group)
+            elif op is sre_parse.IN and all(i_op is sre_parse.LITERAL for i_op,_ in av):
+                groups.append({chr(i_av) for _,i_av in av})
+            elif op in (sre_parse.MAX_REPEAT,sre_parse.MIN_REPEAT) and av[0]>=1:
+                groups+=sequence_groups(av[2])
+        if text:groups.append({text})
+        return groups
+
+    if isinstance(pattern,re.Pattern):
+        if pattern.flags&re.IGNORECASE:return []
+        pattern=pattern.pattern
+    return sequence_groups(sre_parse.parse(pattern))
+
+def has_prefix(key,value):
+    """value是否为key的前缀，用于元组"""
+    return key[:len(value)]==value
+
+def containment_normalize(values,contains=None,replace_increment=0):
+    """
+    按包含关系把属性值聚类，返回出现次数最多的值，次数相同时取先加入的
+    每个值按加入的先后与已有的key比较：被key包含时key次数加一，包含key时换成更长的value
+    :param contains: contains(key,value)判断key是否包含value，默认为字符串的value in key
+    :param replace_increment: 换成更长的值时次数的增加量
+    """
+    res=dict()
+    for value in values:
+        for key in res:
+            if (value in key) if contains is None else contains(key,value):
+                res[key]+=1
+                break
+            if (key in value) if contains is None else contains(value,key):
+                res[value]=res[key]+replace_increment
+                del res[key]
+                break
+        else:res[value]=1
+    return max(res,key=res.get) if res else None
+
+chinese_pattern=re.compile("[\u4e00-\u9fa51234567890]")
+
 def filter_chinese(s):
     """只剩中文字符,但不包含数字"""
-    res=re.findall("[\u4e00-\u9fa51234567890]",s)
+    res=chinese_pattern.findall(s)
     if res:return "".join(res)
 
 def get_values(obj_attribute,json_file):
@@ -89,13 +674,33 @@ def get_values(obj_attribute,json_file):
     :param json_file: 目标文件
     :return: 属性值列表
     """
-    with open(json_file,'r',encoding='utf-8')as file:
-        data=json.loads(file.read())
-    values=[]
-    for item in data:
+    return collect_values({obj_attribute:obj_attribute},json_file)[obj_attribute]
+
+def collect_values(obj_attributes,json_file):
+    """
+    只遍历一次文件，同时收集多个特定属性的属性值列表
+    判断infobox属性名称是否属于特定属性的规则与原来相同（把属性名称当作正则在特定属性名称中搜索），
+    每个infobox属性名称只判断一次，结果缓存起来
+    :param obj_attributes: {名称:特定属性名称}，如{"出生地":"出生地|籍贯","民族":"民族"}
+    :param json_file: 目标文件
+    :return: {名称:属性值列表}
+    """
+    def match_names(attribute):
+        names=[]
+        for name,obj_attribute in obj_attributes.items():
+            try:
+                if re.search(attribute,obj_attribute):names.append(name)
+            except re.error:pass  #属性名称不是合法的正则，不属于任何特定属性
+        return names
+
+    values={name:[] for name in obj_attributes}
+    attribute_names=dict() #infobox属性名称 -> 所属的名称列表
+    for item in iter_json_data(json_file):
         for attribute,value in item["infobox"].items():
-            if re.search(attribute,obj_attribute):
-                values.append(value)
+            names=attribute_names.get(attribute)
+            if names is None:
+                names=attribute_names[attribute]=match_names(attribute)
+            for name in names:values[name].append(value)
     return values
 
 def create_value_vocab(values,obj_file,limit_count=2,limit_len=2):
@@ -132,38 +737,40 @@ def create_value_vocab(values,obj_file,limit_count=2,limit_len=2):
     save_json(value_vocab,obj_file)
     return value_vocab
 
+def make_B2Q_table():
+    """半角转全角的转换表，阿拉伯数字例外：半角数字不变，全角数字转为半角"""
+    table={32:12288}                                          #半角空格直接转化
+    for inside_code in range(33,127):table[inside_code]=inside_code+65248  #半角字符（除空格）根据关系转化
+    for inside_code in range(ord("0"),ord("9")+1):
+        table[inside_code]=inside_code                        #数字保持半角
+        table[inside_code+65248]=inside_code                  #全角数字转为半角
+    return table
+
+def make_Q2B_table():
+    """全角转半角的转换表"""
+    table={0x3000:0x0020}
+    for inside_code in range(0xff00,0xff5f):table[inside_code]=inside_code-0xfee0 #转完之后是半角字符的才转换
+    return table
+
+B2Q_table=make_B2Q_table()
+Q2B_table=make_Q2B_table()
+
 def strB2Q(ustring):
     """让阿拉伯数字为半角，其余为全角"""
     """数字会变化"""
-    rstring = ""
-    for uchar in ustring:
-        inside_code=ord(uchar)
-        if inside_code == 32:                                 #半角空格直接转化
-            inside_code = 12288
-        elif inside_code >= 32 and inside_code <= 126:        #半角字符（除空格）根据关系转化
-            inside_code += 65248
-
-        rstring += chr(inside_code)
-
-    num_Qstr="１２３４５６７８９０"
-    num_Bstr="1234567890"
-    for i in range(10):
-        rstring=rstring.replace(num_Qstr[i],num_Bstr[i])
-    return rstring
+    return ustring.translate(B2Q_table)
 
 def strQ2B(ustring):
     """把字符串全角转半角"""
-    def Q2B(uchar):
-        """单个字符 全角转半角"""
-        inside_code = ord(uchar)
-        if inside_code == 0x3000:
-            inside_code = 0x0020
-        else:
-            inside_code -= 0xfee0
-        if inside_code < 0x0020 or inside_code > 0x7e: #转完之后不是半角字符返回原来的字符
-            return uchar
-        return chr(inside_code)
-    return "".join([Q2B(uchar) for uchar in ustring])
+    return ustring.translate(Q2B_table)
+
+@lru_cache(maxsize=256)
+def cached_strB2Q(ustring):
+    """
+    带缓存的strB2Q
+    同一个item的summary和para会被各个属性分别转换，缓存最近的结果让它们共用一份转换后的文本
+    """
+    return strB2Q(ustring)
 
 def filter_line(s):
 
@@ -185,13 +792,55 @@ def entity2BIO(attribute, value, sep, mode):
             res.append(value[i] + sep + "I-" + attribute)
     else:
         if len(value) == 1:
-            return value + sep + "S-" + attribute
+            return [value + sep + "S-" + attribute]
         res = [value[0] + sep + "B-" + attribute]
         for i in range(1, len(value) - 1):
             res.append(value[i] + sep + "I-" + attribute)
         res.append(value[-1] + sep + "E-" + attribute)
     return res
 
+class ValueTagger():
+    """
+    用字典树给句子打BIO/BIOES标签，句子只从左到右扫描一遍
+    同一位置有多个属性值能匹配时，取传入顺序最靠前的（与逐个比较属性值的结果一致），longest=True时取最长的
+    用法：
+        tagger=ValueTagger([("国籍","中国"),("出生地","北京")])
+        tagger.tag("中国北京人")  ——> ["中\tB-国籍","国\tE-国籍","北\tB-出生地","京\tE-出生地","人\tO"]
+    """
+
+    def __init__(self,values,longest=False):
+        """
+        :param values: （属性，属性值）列表，不是字符串的属性值会被忽略
+        :param longest: 是否取最长匹配
+        """
+        self.root=dict() #键为字符，键None存放在该处结束的（顺序，属性，属性值）
+        self.longest=longest
+        for order,(attribute,value) in enumerate(values):
+            if not isinstance(value,str) or not value:continue
+            node=self.root
+            for char in value:node=node.setdefault(char,dict())
+            if None not in node:node[None]=(order,attribute,value)
+
+    def tag(self,sentence,sep="\t",mode="BIOES"):
+        """返回每个字的标签行列表"""
+        res=[]
+        index=0
+        while index<len(sentence):
+            node=self.root
+            best=None
+            for char in islice(sentence,index,None):
+                node=node.get(char)
+                if node is None:break
+                end=node.get(None)
+                if end and (best is None or self.longest or end[0]<best[0]):best=end
+            if best:
+                res+=entity2BIO(best[1],best[2],sep,mode)
+                index+=len(best[2])
+            else:
+                res.append(sentence[index]+sep+"O")
+                index+=1
+        return res
+
 def json2BIO(json_file,BIO_file,sep="\t",mode="BIOES"):
     "将json里面的文件转化为BIO文件"
     def process_summary(summary):
@@ -204,27 +853,15 @@ def json2BIO(json_file,BIO_file,sep="\t",mode="BIOES"):
                 new_summary.append(summary[i])
         return "，".join(new_summary)
 
-    data=get_json_data(json_file)
+    data=iter_json_data(json_file)
 
 
     with open(BIO_file,'w',encoding='utf-8')as file:
         for item in data:
-            BIO_sentence=[]
             infobox=item['infobox']
             summary=item['summary']
             summary=process_summary(summary)
-            index=0
-            while(index<len(summary)):
-                flag=True
-                for attribute, value in infobox.items():
-                    if summary[index:index+len(value)]==value:
-                        BIO_sentence+=entity2BIO(attribute,value,sep,mode)
-                        index+=len(value)
-                        flag=False
-                        break
-                if flag:
-                    BIO_sentence.append(summary[index]+sep+"O")
-                    index+=1
+            BIO_sentence=ValueTagger(infobox.items()).tag(summary,sep,mode)
             BIO_sentence="\n".join(BIO_sentence)+"\n\n"
             file.write(BIO_sentence)
 
@@ -235,58 +872,522 @@ def limit_attribute_nums(json_file,new_json_file,limit_num):
         if len(item["infobox"]) >= limit_num: new_data.append(item)
     save_json(new_data, new_json_file)
 
-def get_remote_json_info(json_file):
-    data = get_json_data(json_file)
-    res = dict()
-    res["条目数"] = len(data)
-    res["属性分布"] = dict()
-    sentence_len = []  # 句子长度
-    attribute_len=[]
-    for item in data:
-        if "para" in item.keys():
-            item["summary"]=item["para"]+[item["summary"]]
-        attribute_len.append(len(item["infobox"]))
-        for attribute in item["infobox"].keys():
-            if attribute in res["属性分布"].keys():
-                res["属性分布"][attribute] += 1
+def percentage(num):
+    """将小数转化成百分比格式,保留两位小数"""
+    return str(int(num*10000)/100)+"%"
+
+def item_sentences(item):
+    """条目的全部句子，有para时为para加summary"""
+    if "para" in item.keys():return item["para"]+[item["summary"]]
+    summary=item["summary"] or []
+    return [summary] if isinstance(summary,str) else summary
+
+class CorpusStatistics():
+    """
+    单遍统计，一次遍历同时得到：
+        属性分布、各属性的值分布、属性数量分布、句长分布及分位数、属性覆盖率
+    句长为一个条目所有句子的长度之和，每个条目只算一次
+    各分片的统计结果可以用merge合并，合并后与整体统计一次的结果相同
+    用法：
+        statistics=CorpusStatistics().update_all(iter_json_data(json_file))
+        statistics.result()
+    """
+
+    def __init__(self,value_attributes=None,sentence_len_bin=100):
+        """
+        :param value_attributes: 要统计值分布的属性，None为全部属性，()为不统计
+        :param sentence_len_bin: 句长分布的区间宽度
+        """
+        self.value_attributes=None if value_attributes is None else set(value_attributes)
+        self.sentence_len_bin=sentence_len_bin
+        self.item_num=0
+        self.attribute_count=Counter()       #属性——>条目数
+        self.value_count=dict()              #属性——>Counter(属性值——>次数)
+        self.attribute_num_count=Counter()   #属性数量——>条目数
+        self.sentence_len_count=Counter()    #句长——>条目数
+
+    def update(self,item):
+        self.item_num+=1
+        infobox=item["infobox"]
+        self.attribute_num_count[len(infobox)]+=1
+        self.attribute_count.update(infobox.keys())
+        for attribute,value in infobox.items():
+            if self.value_attributes is not None and attribute not in self.value_attributes:continue
+            counter=self.value_count.get(attribute)
+            if counter is None:counter=self.value_count[attribute]=Counter()
+            if isinstance(value,list):counter.update(value)  #多属性值分别计数
+            else:counter[value]+=1
+        self.sentence_len_count[sum(len(i) for i in item_sentences(item) if i)]+=1
+        return self
+
+    def update_all(self,data):
+        for item in data:self.update(item)
+        return self
+
+    def merge(self,other):
+        """合并另一个分片的统计结果"""
+        self.item_num+=other.item_num
+        self.attribute_count.update(other.attribute_count)
+        for attribute,counter in other.value_count.items():
+            self.value_count.setdefault(attribute,Counter()).update(counter)
+        self.attribute_num_count.update(other.attribute_num_count)
+        self.sentence_len_count.update(other.sentence_len_count)
+        return self
+
+    def quantiles(self,qs=(0.25,0.5,0.75,0.9,0.99)):
+        """句长的分位数，由句长计数直接算出，是精确值"""
+        res=dict()
+        if not self.item_num:return res
+        lens=sorted(self.sentence_len_count.items())
+        idx,count=0,0
+        for q in sorted(qs):
+            rank=q*(self.item_num-1)  #第rank个条目（从0开始）的句长
+            while count+lens[idx][1]<=rank:
+                count+=lens[idx][1]
+                idx+=1
+            res[q]=lens[idx][0]
+        return res
+
+    def value_distribution(self,attribute_name):
+        return sort_dict(self.value_count.get(attribute_name,{}))
+
+    def coverage(self):
+        """各属性的条目占比"""
+        return {k:percentage(v/self.item_num) for k,v in sort_dict(self.attribute_count).items()}
+
+    def result(self):
+        res = dict()
+        res["条目数"] = self.item_num
+        res["属性分布"] = sort_dict(self.attribute_count)
+        item_num=self.item_num or 1
+        res["平均句长"] = sum(k*v for k,v in self.sentence_len_count.items())/item_num
+        bin_count=Counter()
+        for k,v in self.sentence_len_count.items():bin_count[k//self.sentence_len_bin*self.sentence_len_bin]+=v
+        res["句长分布"] = sort_dict(bin_count,obj="key",reverse=False)
+        res["句长分位数"] = self.quantiles()
+        res["属性数量分布"] = sort_dict(self.attribute_num_count, obj="value", reverse=False)
+        res["平均属性数量"] = sum(k*v for k,v in self.attribute_num_count.items())/item_num
+        res["属性覆盖率"] = self.coverage()
+        return res
+
+class HeavyHitters():
+    """
+    高频值（Misra-Gries摘要），最多保留capacity个值
+    计数只会偏小：真实次数在[count,count+error]之间，error=self.error
+    次数超过 总数/(capacity+1) 的值一定在摘要中
+    """
+
+    def __init__(self,capacity=100):
+        self.capacity=capacity
+        self.counts=dict()
+        self.error=0  #累计扣减的次数，即计数的误差上界
+        self.total=0
+
+    def add(self,value,count=1):
+        self.total+=count
+        self.counts[value]=self.counts.get(value,0)+count
+        if len(self.counts)>2*self.capacity:self.compress()
+
+    def compress(self):
+        """所有计数减去第capacity+1大的计数，只留下正的，摊还下来每次add为O(1)"""
+        if len(self.counts)<=self.capacity:return
+        cut=sorted(self.counts.values(),reverse=True)[self.capacity]
+        self.error+=cut
+        self.counts={k:v-cut for k,v in self.counts.items() if v>cut}
+
+    def merge(self,other):
+        self.total+=other.total
+        self.error+=other.error
+        for value,count in other.counts.items():self.counts[value]=self.counts.get(value,0)+count
+        self.compress()
+        return self
+
+    def top(self,k=None):
+        """按估计次数从多到少的{值:次数}"""
+        res=sort_dict(self.counts)
+        if k is not None:res=dict(islice(res.items(),k))
+        return res
+
+class HyperLogLog():
+    """
+    不同值数量的估计，占用2**precision字节，相对标准误差约为1.04/sqrt(2**precision)
+    用blake2b哈希，不受PYTHONHASHSEED影响，不同进程的结果可以合并
+    """
+
+    def __init__(self,precision=12):
+        self.precision=precision
+        self.registers=bytearray(1<<precision)
+
+    def add(self,value):
+        h=int.from_bytes(hashlib.blake2b(str(value).encode("utf-8"),digest_size=8).digest(),"big")
+        idx=h>>(64-self.precision)
+        w=h&((1<<(64-self.precision))-1)
+        rank=64-self.precision-w.bit_length()+1
+        if rank>self.registers[idx]:self.registers[idx]=rank
+
+    def merge(self,other):
+        self.registers=bytearray(map(max,self.registers,other.registers))
+        return self
+
+    @property
+    def relative_error(self):
+        return 1.04/math.sqrt(len(self.registers))
+
+    def count(self):
+        m=len(self.registers)
+        alpha={16:0.673,32:0.697,64:0.709}.get(m,0.7213/(1+1.079/m))
+        estimate=alpha*m*m/sum(2.0**-r for r in self.registers)
+        zeros=self.registers.count(0)
+        if estimate<=2.5*m and zeros:estimate=m*math.log(m/zeros)  #小范围用线性计数
+        return int(round(estimate))
+
+class QuantileSketch():
+    """
+    分位数估计（DDSketch），按对数区间计数
+    估计值与真实分位数的相对误差不超过relative_accuracy，区间数与数据量无关
+    """
+
+    def __init__(self,relative_accuracy=0.01):
+        self.relative_accuracy=relative_accuracy
+        self.gamma=(1+relative_accuracy)/(1-relative_accuracy)
+        self.log_gamma=math.log(self.gamma)
+        self.buckets=Counter()
+        self.zero_count=0
+        self.count=0
+
+    def add(self,x):
+        self.count+=1
+        if x<=0:self.zero_count+=1
+        else:self.buckets[math.ceil(math.log(x)/self.log_gamma)]+=1
+
+    def merge(self,other):
+        self.count+=other.count
+        self.zero_count+=other.zero_count
+        self.buckets.update(other.buckets)
+        return self
+
+    def quantile(self,q):
+        if not self.count:return None
+        rank=q*(self.count-1)
+        count=self.zero_count
+        if count>rank:return 0
+        for idx in sorted(self.buckets):
+            count+=self.buckets[idx]
+            if count>rank:return 2*self.gamma**idx/(self.gamma+1)
+
+    def quantiles(self,qs=(0.25,0.5,0.75,0.9,0.99)):
+        return {q:self.quantile(q) for q in qs}
+
+class ApproxCorpusStatistics():
+    """
+    CorpusStatistics的近似版本，内存与不同值的数量无关，用于在全部数据上快速查看
+    属性分布、属性数量分布、平均句长是精确的
+    值分布只保留高频值，不同值数量和句长分位数是估计值，结果中附带误差
+    summary和para的长度分别估计分位数
+    """
+
+    def __init__(self,value_attributes=None,top_k=100,precision=12,relative_accuracy=0.01):
+        """
+        :param value_attributes: 要统计值分布的属性，None为全部属性，()为不统计
+        :param top_k: 每个属性保留的高频值数量
+        :param precision: HyperLogLog的精度
+        :param relative_accuracy: 分位数的相对误差
+        """
+        self.value_attributes=None if value_attributes is None else set(value_attributes)
+        self.top_k=top_k
+        self.precision=precision
+        self.relative_accuracy=relative_accuracy
+        self.item_num=0
+        self.sentence_len_sum=0
+        self.attribute_count=Counter()
+        self.attribute_num_count=Counter()
+        self.heavy_hitters=dict()    #属性——>HeavyHitters
+        self.distinct_values=dict()  #属性——>HyperLogLog
+        self.summary_len=QuantileSketch(relative_accuracy)
+        self.para_len=QuantileSketch(relative_accuracy)
+
+    def update(self,item):
+        self.item_num+=1
+        infobox=item["infobox"]
+        self.attribute_num_count[len(infobox)]+=1
+        self.attribute_count.update(infobox.keys())
+        for attribute,value in infobox.items():
+            if self.value_attributes is not None and attribute not in self.value_attributes:continue
+            heavy_hitters=self.heavy_hitters.get(attribute)
+            if heavy_hitters is None:
+                heavy_hitters=self.heavy_hitters[attribute]=HeavyHitters(self.top_k)
+                self.distinct_values[attribute]=HyperLogLog(self.precision)
+            distinct_values=self.distinct_values[attribute]
+            for v in (value if isinstance(value,list) else [value]):
+                #摘要里已有的值之前一定加过HyperLogLog，重复加不改变结果，省去哈希
+                if v not in heavy_hitters.counts:distinct_values.add(v)
+                heavy_hitters.add(v)
+        summary=item["summary"] or []
+        summary_len=len(summary) if isinstance(summary,str) else sum(len(i) for i in summary if i)
+        para_len=sum(len(i) for i in item["para"] if i) if "para" in item.keys() else 0
+        self.summary_len.add(summary_len)
+        if "para" in item.keys():self.para_len.add(para_len)
+        self.sentence_len_sum+=summary_len+para_len
+        return self
+
+    def update_all(self,data):
+        for item in data:self.update(item)
+        return self
+
+    def merge(self,other):
+        self.item_num+=other.item_num
+        self.sentence_len_sum+=other.sentence_len_sum
+        self.attribute_count.update(other.attribute_count)
+        self.attribute_num_count.update(other.attribute_num_count)
+        for attribute,heavy_hitters in other.heavy_hitters.items():
+            if attribute in self.heavy_hitters:
+                self.heavy_hitters[attribute].merge(heavy_hitters)
+                self.distinct_values[attribute].merge(other.distinct_values[attribute])
             else:
-                res["属性分布"][attribute] = 1
-            sentence_len.append( sum([len(i) for i in item["summary"]]))
-    res["属性分布"] = sort_dict(res["属性分布"])
-    res["平均句长"] = sum(sentence_len) / res["条目数"]
-    # res["句长分布"]=sort_dict(list2dict(sentence_len),obj="value",reverse=False)
-    res["属性数量分布"] = sort_dict(list2dict(attribute_len), obj="value", reverse=False)
-    res["平均属性数量"]=sum(attribute_len)/len(attribute_len)
+                self.heavy_hitters[attribute]=heavy_hitters
+                self.distinct_values[attribute]=other.distinct_values[attribute]
+        self.summary_len.merge(other.summary_len)
+        self.para_len.merge(other.para_len)
+        return self
+
+    def value_distribution(self,attribute_name):
+        """高频值及其估计次数，真实次数在[次数,次数+误差]之间，误差见value_error"""
+        if attribute_name not in self.heavy_hitters:return dict()
+        return self.heavy_hitters[attribute_name].top(self.top_k)
+
+    def value_error(self,attribute_name):
+        if attribute_name not in self.heavy_hitters:return 0
+        return self.heavy_hitters[attribute_name].error
+
+    def coverage(self):
+        return {k:percentage(v/self.item_num) for k,v in sort_dict(self.attribute_count).items()}
+
+    def result(self):
+        res = dict()
+        res["条目数"] = self.item_num
+        res["属性分布"] = sort_dict(self.attribute_count)
+        item_num=self.item_num or 1
+        res["平均句长"] = self.sentence_len_sum/item_num
+        res["summary长度分位数"] = self.summary_len.quantiles()
+        res["para长度分位数"] = self.para_len.quantiles()
+        res["分位数相对误差"] = self.relative_accuracy
+        res["属性数量分布"] = sort_dict(self.attribute_num_count, obj="value", reverse=False)
+        res["平均属性数量"] = sum(k*v for k,v in self.attribute_num_count.items())/item_num
+        res["属性覆盖率"] = self.coverage()
+        res["不同值数量"] = {k:self.distinct_values[k].count() for k in self.heavy_hitters}
+        res["不同值数量相对误差"] = 1.04/math.sqrt(1<<self.precision)
+        res["高频值"] = {k:self.value_distribution(k) for k in self.heavy_hitters}
+        res["高频值误差"] = {k:self.value_error(k) for k in self.heavy_hitters}
+        return res
+
+def _file_statistics(task):
+    json_file,value_attributes,approx=task
+    statistics=ApproxCorpusStatistics(value_attributes) if approx else CorpusStatistics(value_attributes)
+    return statistics.update_all(iter_json_data(json_file))
+
+def get_corpus_statistics(json_files,value_attributes=None,processes=1,approx=False):
+    """
+    统计一个或多个json文件（如分片），processes>1时每个文件交给一个进程，最后合并
+    :param approx: 为True时用ApproxCorpusStatistics
+    :return: CorpusStatistics或ApproxCorpusStatistics
+    """
+    if isinstance(json_files,str):json_files=[json_files]
+    tasks=((json_file,value_attributes,approx) for json_file in json_files)
+    if processes>1:results=ordered_pool_map(_file_statistics,tasks,processes)
+    else:results=map(_file_statistics,tasks)
+    statistics=None
+    for result in results:statistics=result if statistics is None else statistics.merge(result)
+    if statistics is None:statistics=ApproxCorpusStatistics(value_attributes) if approx else CorpusStatistics(value_attributes)
+    return statistics
+
+def get_remote_json_info(json_file,approx=False):
+    res = get_corpus_statistics(json_file,value_attributes=None if approx else (),approx=approx).result()
     for key, value in res.items():
         print(key + ":")
         print(value)
     return res
     
-def get_value_distribution(json_file,attribute_name):
-
-    data=get_json_data(json_file)
-    value_dict=dict()
-    for item in data:
-        if attribute_name in item["infobox"].keys():
-            value=item["infobox"][attribute_name]
-            value_dict[value]=value_dict.setdefault(value,0)+1
-    return sort_dict(value_dict)
+def get_value_distribution(json_file,attribute_name,approx=False):
+    """approx为True时只返回高频值，次数偏小，误差上界见ApproxCorpusStatistics.value_error"""
+    return get_corpus_statistics(json_file,value_attributes=[attribute_name],approx=approx).value_distribution(attribute_name)
 
 def get_attribute_distribution(json_file):
-    def percentage(num):
-        """将小数转化成百分比格式,保留两位小数"""
-        return str(int(num*10000)/100)+"%"
+    return get_corpus_statistics(json_file,value_attributes=()).coverage()
 
-    data=get_json_data(json_file)
-    person_num=len(data)
-    attributes=[]
-    for item in data:
-        attributes+=item["infobox"]
-    attributes=list2dict(attributes)
-    for i in attributes.keys():
-        attributes[i]=percentage(attributes[i]/person_num)
+def score_item(item,info):
+    """
+    按照infobox的质量对条目打分
+        属性越多分越高
+        属性越稀有分越高：属性占比倒数之和
+        属性相对句长越密集分越高
+    :param info: CorpusStatistics.result()，只用到条目数和属性分布
+    """
+    sentence_len=sum(len(i) for i in item_sentences(item) if i) or 1
+    score=0
+    for attribute in item["infobox"].keys():
+        score+=info["条目数"]/info["属性分布"][attribute]
+        score+=len(item["infobox"])/sentence_len*10
+    return score
 
-    return attributes
+def select_top_items(items,k,key,start=0):
+    """
+    流式选出key最大的第start到start+k个条目，堆中最多start+k个条目
+    结果与 sorted(items,key=key,reverse=True)[start:start+k] 相同（分数相同时先出现的在前），k<=0时返回空列表
+    """
+    size=start+k
+    if k<=0 or size<=0:return []
+    heap=[]  #（分数，-序号，条目），堆顶为目前最差的条目
+    for seq,item in enumerate(items):
+        entry=(key(item),-seq,item)
+        if len(heap)<size:heapq.heappush(heap,entry)
+        elif entry[:2]>heap[0][:2]:heapq.heapreplace(heap,entry)
+    heap.sort(key=lambda entry:entry[:2],reverse=True)
+    return [entry[2] for entry in heap[start:]]
+
+def select_json_items(json_file,des_file,k,start=0,by="score",pretty=False):
+    """
+    从json_file中选出最好的第start到start+k个条目，不需要把全部条目读入内存
+    第一遍统计属性分布，第二遍选择
+    :param by:
+        score：按score_item打分，用堆保留最好的start+k个条目
+        attribute_num：按属性数量，由属性数量分布算出每个条目的名次，只保留名次在范围内的条目再分桶写入
+    """
+    statistics=get_corpus_statistics(json_file,value_attributes=())
+    if by=="score":
+        info=statistics.result()
+        items=select_top_items(iter_json_data(json_file),k,lambda item:score_item(item,info),start)
+        with JsonWriter(des_file,pretty=pretty) as writer:writer.write_all(items)
+    elif by=="attribute_num":
+        rank=dict()  #属性数量——>该数量的第一个条目的名次
+        count=0
+        for attribute_num in sorted(statistics.attribute_num_count,reverse=True):
+            rank[attribute_num]=count
+            count+=statistics.attribute_num_count[attribute_num]
+        def iter_selected():
+            for item in iter_json_data(json_file):
+                attribute_num=len(item["infobox"])
+                if start<=rank[attribute_num]<start+k:yield item
+                rank[attribute_num]+=1
+        write_json_buckets(iter_selected(),des_file,key=lambda item:len(item["infobox"]),reverse=True,pretty=pretty)
+    else:raise Exception("未知的选择方式："+by)
+
+def item_text(item):
+    """条目的summary文本，用于比较条目是否重复"""
+    summary=item["summary"] or ""
+    return summary if isinstance(summary,str) else "".join(summary)
+
+class NearDuplicateDetector():
+    """
+    近似重复检测（MinHash+LSH）
+    文本切成shingle_size个字的片段，用单次置换MinHash（one permutation hashing）得到num_perm维签名
+    签名分成bands段，任意一段完全相同的条目成为候选，再用签名估计的Jaccard相似度不低于threshold的判为重复
+    只有保留下来的条目进入索引，先出现的条目作为簇的代表，每个条目和同桶的所有代表比较，不需要两两比较
+    相似度为s的两个条目成为候选的概率为 1-(1-s**(num_perm/bands))**bands
+    用法：
+        detector=NearDuplicateDetector(threshold=0.8)
+        for item in data:
+            if detector.add(item["name"],item_text(item)) is None:保留item
+        detector.clusters  #{代表:[(重复条目,相似度)]}
+    """
+
+    def __init__(self,threshold=0.8,num_perm=64,bands=16,shingle_size=5,seed=0):
+        if num_perm%bands:raise Exception("num_perm必须是bands的整数倍")
+        self.threshold=threshold
+        self.num_perm=num_perm
+        self.bands=bands
+        self.rows=num_perm//bands
+        self.shingle_size=shingle_size
+        self.seed=seed
+        self.keys=[]          #代表的键
+        self.signatures=[]    #代表的签名
+        self.buckets=[dict() for _ in range(bands)]  #每段签名——>代表下标列表
+        self.clusters=dict()  #代表的键——>[(重复条目的键,相似度)]
+
+    def signature(self,text):
+        """文本的MinHash签名，文本为空时返回None"""
+        if not text:return None
+        data=memoryview(text.encode("utf-16-le"))  #每个字2字节，片段按字对齐
+        width=2*self.shingle_size
+        num_perm,seed=self.num_perm,self.seed
+        mins=[0xffffffff+1]*num_perm
+        for i in range(0,max(len(data)-width,0)+1,2):
+            h=zlib.crc32(data[i:i+width],seed)
+            b=h%num_perm
+            v=h//num_perm
+            if v<mins[b]:mins[b]=v
+        #空槽从右边最近的非空槽借值（循环），加上距离区分
+        empty=0xffffffff+1
+        filled=[j for j in range(num_perm) if mins[j]!=empty]
+        if len(filled)<num_perm:
+            for j in range(num_perm):
+                if mins[j]!=empty:continue
+                k=filled[bisect_right(filled,j)%len(filled)]
+                mins[j]=(mins[k]+((k-j)%num_perm)*0x9e3779b1)&0xffffffff
+        return array("I",mins)
+
+    def similarity(self,signature1,signature2):
+        """签名估计的Jaccard相似度"""
+        return sum(a==b for a,b in zip(signature1,signature2))/self.num_perm
+
+    def query(self,signature):
+        """返回最相似的代表（键,相似度），没有达到阈值的返回None"""
+        raw=signature.tobytes()
+        size=4*self.rows
+        best=None
+        seen=set()
+        for band,bucket in enumerate(self.buckets):
+            for idx in bucket.get(raw[band*size:(band+1)*size],()):
+                if idx in seen:continue
+                seen.add(idx)
+                sim=self.similarity(signature,self.signatures[idx])
+                if sim>=self.threshold and (best is None or sim>best[1]):best=(self.keys[idx],sim)
+        return best
+
+    def insert(self,key,signature):
+        idx=len(self.keys)
+        self.keys.append(key)
+        self.signatures.append(signature)
+        raw=signature.tobytes()
+        size=4*self.rows
+        for band,bucket in enumerate(self.buckets):
+            bucket.setdefault(raw[band*size:(band+1)*size],[]).append(idx)
+
+    def add(self,key,text):
+        """
+        加入一个条目
+        :return: 与之重复的代表的键，不重复时返回None并把条目作为新的代表
+        """
+        signature=self.signature(text)
+        if signature is None:return None
+        found=self.query(signature)
+        if found:
+            self.clusters.setdefault(found[0],[]).append((key,found[1]))
+            return found[0]
+        self.insert(key,signature)
+        return None
+
+    def report(self):
+        """被合并的簇，按簇的大小从大到小"""
+        clusters=sorted(self.clusters.items(),key=lambda cluster:len(cluster[1]),reverse=True)
+        return [{"name":key,"duplicates":[{"name":k,"similarity":s} for k,s in duplicates]} for key,duplicates in clusters]
+
+def remove_near_duplicates(items,detector,key=lambda item:item["name"],text=item_text):
+    """去掉与前面条目近似重复的条目，保留第一次出现的"""
+    for item in items:
+        if detector.add(key(item),text(item)) is None:yield item
+
+def remove_near_duplicate_file(json_file,des_file,report_file=None,pretty=False,**kwargs):
+    """
+    对文件去近似重复
+    :param report_file: 保存被合并的簇
+    :param kwargs: NearDuplicateDetector的参数
+    :return: NearDuplicateDetector
+    """
+    detector=NearDuplicateDetector(**kwargs)
+    with JsonWriter(des_file,pretty=pretty) as writer:
+        writer.write_all(remove_near_duplicates(iter_json_data(json_file),detector))
+    if report_file:save_json(detector.report(),report_file)
+    return detector
 
 def data2excel(data, des_file, mode="dict1",columns=[]):
     """
@@ -319,51 +1420,61 @@ def data2excel(data, des_file, mode="dict1",columns=[]):
     df = pd.DataFrame(data, columns=columns)
     df.to_excel(des_file, index=False)
 
-def json2mrc(json_file,des_mrc_dir,mode="BIOES",sep="\t"):
+def json2mrc(json_file,des_mrc_dir,mode="BIOES",sep="\t",stream=False,seed=0,shuffle=False):
+    """
+    造mrc的训练数据，按8:1:1分为train、test、dev
+    :param stream: 为True时边生成边按人名的哈希分配写入三个文件，内存占用与数据量无关，
+        同一个人的样本总在同一个文件中，避免train和test之间泄漏，但文件内的样本保持生成顺序；
+        为False时全部生成后用固定种子打乱再切分
+    :param seed: 哈希或打乱用的种子
+    :param shuffle: stream为True时是否用ExternalShuffler在外存中打乱样本顺序，内存占用仍与数据量无关
+    """
 
     def get_question(attribute):
         return "该人物的"+attribute+"是什么?"
 
     def BIO_mark(line,attribute,values):
-        BIO_sentence=[]
         if not isinstance(values,list):values=[values]
-        index = 0
-        while (index < len(line)):
-            flag=True
-            for value in values:
-                if line[index:index + len(value)] == value:
-                    BIO_sentence += entity2BIO(value=value, sep=sep,attribute=attribute,mode=mode)
-                    index += len(value)
-                    flag=False
-                    break
-            if flag:
-                BIO_sentence.append(line[index] + sep + "O")
-                index += 1
+        BIO_sentence=ValueTagger([(attribute,value) for value in values]).tag(line,sep,mode)
         return "\n".join(BIO_sentence)
 
-    data = get_json_data(json_file)
-
-    new_data=[]
-    for item in data:
-        infobox = item['infobox']
-        summary = item['summary']
-        for attribute, value in infobox.items():
-            if isinstance(value, list):
-                flag=False
-                for line in item['summary']:
-                    line=line[:1000]
-                    for v in value:
-                        if v in line:
-                            new_data.append(get_question(attribute)+"\n"+BIO_mark(line,attribute,value))
-                            flag=True
+    def iter_samples(data):
+        """生成（人名，样本）"""
+        for item in data:
+            infobox = item['infobox']
+            summary = item['summary']
+            for attribute, value in infobox.items():
+                if isinstance(value, list):
+                    flag=False
+                    for line in item['summary']:
+                        line=line[:1000]
+                        for v in value:
+                            if v in line:
+                                yield item['name'],get_question(attribute)+"\n"+BIO_mark(line,attribute,value)
+                                flag=True
+                                break
+                        if flag:break
+                else:
+                    for line in summary:
+                        if value in line:
+                            yield item['name'],get_question(attribute)+"\n"+BIO_mark(line,attribute,value)
                             break
-                    if flag:break
+
+    data = iter_json_data(json_file)
+    if stream:
+        files=[des_mrc_dir+"/train.txt",des_mrc_dir+"/test.txt",des_mrc_dir+"/dev.txt"]
+        with SplitWriter(files,seed=seed) as writer:
+            if shuffle:
+                with ExternalShuffler(seed=seed) as shuffler:
+                    shuffler.add_all(iter_samples(data))
+                    for name,sample in shuffler:writer.write(sample,key=name)
             else:
-                for line in summary:
-                    if value in line:
-                        new_data.append(get_question(attribute)+"\n"+BIO_mark(line,attribute,value))
-                        break
-    random.shuffle(new_data)
+                for name,sample in iter_samples(data):writer.write(sample,key=name)
+        print(sum(writer.counts))
+        return
+
+    new_data=[sample for _,sample in iter_samples(data)]
+    random.Random(seed).shuffle(new_data)
     print(len(new_data))
     train_data,test_data,dev_data=cut_data(new_data)
     train_data="\n\n".join(train_data)
@@ -377,54 +1488,135 @@ def json2mrc(json_file,des_mrc_dir,mode="BIOES",sep="\t"):
         file.write(dev_data)
 
 def get_data_index(data_file,des_file,start,end):
+    cut_json_data(data_file,des_file,start,end)
+
+def split_json_data(json_file,des_files,rate="default",key=lambda item:item["name"],seed=0,pretty=False):
+    """
+    按key的哈希把条目流式地分到多个文件中（如train/test/dev），比例默认8:1:1（期望比例）
+    同一个人总在同一个文件中，结果只取决于key和seed，与条目顺序和数据量无关
+    :return: 各文件的条目数
+    """
+    if rate=="default":rate=[0.8,0.1,0.1]
+    elif not math.isclose(sum(rate),1): raise Exception("概率和不等于1")
+    if len(rate)!=len(des_files): raise Exception("文件数量与比率数量不一致")
+    bounds=[sum(rate[:i+1]) for i in range(len(rate))]
+    writers=[JsonWriter(des_file,pretty=pretty) for des_file in des_files]
+    try:
+        for item in iter_json_data(json_file):
+            index=min(bisect_right(bounds,hash_fraction(key(item),seed)),len(writers)-1)
+            writers[index].write(item)
+    finally:
+        for writer in writers:writer.close()
+    return [writer.count for writer in writers]
+
+def shard_json_data(json_file,des_pattern,num_shards,key=lambda item:item["name"],seed=0,pretty=False):
+    """
+    按key的哈希把条目流式地分成num_shards片，第i片保存在des_pattern.format(i)
+    :return: 各片的条目数
+    """
+    writers=[JsonWriter(des_pattern.format(i),pretty=pretty) for i in range(num_shards)]
+    try:
+        for item in iter_json_data(json_file):
+            writers[stable_hash(key(item),seed)%num_shards].write(item)
+    finally:
+        for writer in writers:writer.close()
+    return [writer.count for writer in writers]
 
-    data=get_json_data(data_file)
-    save_json(data[start:end],des_file)
+#json2mrc_all中每句话都要问的属性
+mrc_all_attributes = [
+    # 先前的属性
+    "国籍", "性别", "身高", "体重", "民族", "学历", "毕业院校", "出生地", "出生日期", "逝世日期",
+    # 后加的属性
+    "姓名", "外文名", "运动项目", "所属运动队", "场上位置", "信仰"
+]
 
-def json2mrc_all(json_file,des_mrc_dir,sep="\t"):
+class MRCAllData():
+    """
+    json2mrc_all造出的数据的惰性视图
+    每句话只在dev_sentences.json中存一次，样本（问题，句子，标签列表）在访问时才生成
+    样本顺序与dev.txt相同：第i个样本为第i//len(attributes)句话、第i%len(attributes)个属性
+    随机访问时打开的文件用close关闭，或者用with
+    用法：
+        with MRCAllData(des_mrc_dir) as data:
+            question,sentence,labels=data[0]
+            for question,sentence,labels in data:...
+            data.to_text(des_mrc_dir+"/dev.txt")  #流式导出原来的文本格式
+    """
+
+    def __init__(self,des_mrc_dir,attributes=None):
+        self.sentence_file=des_mrc_dir+"/dev_sentences.json"
+        self.attributes=attributes or mrc_all_attributes
+        self.file=None
+        self.offsets=array('q') #每句话在文件中的位置
+        with open(self.sentence_file,'rb')as file:
+            offset=0
+            for line in file:
+                if line.strip():self.offsets.append(offset)
+                offset+=len(line)
+
+    def __len__(self):
+        return len(self.offsets)*len(self.attributes)
+
+    def get_sentence(self,index):
+        """随机读取第index句话"""
+        if self.file is None:self.file=open(self.sentence_file,'rb')
+        self.file.seek(self.offsets[index])
+        return json.loads(self.file.readline())
+
+    def make_sample(self,attribute,sentence):
+        return "该人物的"+attribute+"是什么?",sentence,["O"]*len(sentence)
+
+    def __getitem__(self,index):
+        if index<0:index+=len(self)
+        if not 0<=index<len(self):raise IndexError(index)
+        sentence_index,attribute_index=divmod(index,len(self.attributes))
+        return self.make_sample(self.attributes[attribute_index],self.get_sentence(sentence_index))
+
+    def __iter__(self):
+        for sentence in iter_json_data(self.sentence_file):
+            for attribute in self.attributes:
+                yield self.make_sample(attribute,sentence)
+
+    def to_text(self,filename,sep="\t"):
+        """流式导出为原来的dev.txt格式"""
+        with open(filename,'w',encoding='utf-8')as file:
+            for index,(question,sentence,labels) in enumerate(self):
+                if index:file.write("\n\n")
+                file.write(question+"\n"+"\n".join(char+sep+label for char,label in zip(sentence,labels)))
+
+    def close(self):
+        if self.file is not None:self.file.close()
+        self.file=None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+def json2mrc_all(json_file,des_mrc_dir,sep="\t",compact=False):
     """
     造全部的数据，包括负样例
-    :param attributes: 应该标的属性值
     :param json_file: 原数据
-    :param des_mrc_dir: 目录，包含两个文件
-        dev.txt，造好的数据
+    :param des_mrc_dir: 目录，包含以下文件
+        dev_sentences.json：每行一句话，每句话只存一次，用MRCAllData读取
+        dev.txt：造好的数据，compact为True时不生成
         dev_info.json：infobox和句子长度
     :param sep:
+    :param compact: 为True时只保存紧凑格式，不展开成dev.txt
     :return:
     """
-    def get_question(attribute):
-        return "该人物的"+attribute+"是什么?"
+    data = iter_json_data(json_file)
 
-    def BIO_mark(sentence):
-        BIO_sentence=[i + sep + "O" for i in sentence]
-        return "\n".join(BIO_sentence)
-
-    data = get_json_data(json_file)
-
-    new_data=[]
-    new_info=[]
-    attributes = [
-        # 先前的属性
-        "国籍", "性别", "身高", "体重", "民族", "学历", "毕业院校", "出生地", "出生日期", "逝世日期",
-        # 后加的属性
-        "姓名", "外文名", "运动项目", "所属运动队", "场上位置", "信仰"
-    ]
-    for item in data:
-        if "para" in item.keys():sentences = [item['summary']]+item["para"]
-        else:sentences = item['summary']
-        sentences_count=0
-        for sentence in sentences:
-            for attribute in attributes:
-                new_data.append(get_question(attribute) + "\n" + BIO_mark(sentence))
-                sentences_count+=1
-        new_info.append({"infobox":item['infobox'],"sentence_len":sentences_count})
-
-    print(len(new_data))
-    new_data="\n\n".join(new_data)
-    dev=des_mrc_dir+"/dev.txt"
+    sentence_file=des_mrc_dir+"/dev_sentences.json"
     dev_info=des_mrc_dir+"/dev_info.json"
-    with open(dev, 'w', encoding='utf-8')as file:
-        file.write(new_data)
-    save_json(new_info,dev_info)
+    with JsonWriter(sentence_file) as sentence_writer,JsonWriter(dev_info,pretty=True) as info_writer:
+        for item in data:
+            if "para" in item.keys():sentences = [item['summary']]+item["para"]
+            else:sentences = item['summary']
+            sentence_writer.write_all(sentences)
+            info_writer.write({"infobox":item['infobox'],"sentence_len":len(sentences)*len(mrc_all_attributes)})
 
-get_remote_json_info("output/remote_supervision_result_process.json")
\ No newline at end of file
+    with MRCAllData(des_mrc_dir) as mrc_data:
+        print(len(mrc_data))
+        if not compact:mrc_data.to_text(des_mrc_dir+"/dev.txt",sep)